@@ -0,0 +1,108 @@
+"""
+这个文件是阅读器各子系统的性能基准测试
+
+用法: python benchmarks.py <PDF 文件> [测试项 ...]
+"""
+
+import re
+import sys
+import time
+
+import fitz
+
+from links import extract_text_urls
+from my_classes import PDFMultiPageWriter
+
+WRITER_ENTRIES = 20000  # 写入基准的目录条数，文件目录不足时用合成条目补齐
+
+
+def legacy_extract_text_urls(text, page):
+    """旧实现：正则匹配整页文本后，对每个URL再调用一次 page.search_for 定位（仅用于对比）"""
+
+    urls = []
+    for match in re.finditer(r'https?://[^\s\)\]]+', text):
+        url = match.group()
+        areas = page.search_for(url)
+        if areas:
+            urls.append({"type": "text", "url": url, "rect": areas[0], "text": url})
+    return urls
+
+
+def bench_urls(doc):
+    """逐页对比新旧两种文本URL定位方式的耗时"""
+
+    legacy_time = new_time = 0.0
+    legacy_count = new_count = 0
+    for page in doc:
+        start = time.perf_counter()
+        legacy_count += len(legacy_extract_text_urls(page.get_text("text"), page))
+        legacy_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        new_count += len(extract_text_urls(page.get_text("words")))
+        new_time += time.perf_counter() - start
+
+    print(f"urls: {doc.page_count} pages")
+    print(f"  search_for per url: {legacy_time * 1000:9.1f} ms, {legacy_count} urls")
+    print(f"  single pass words:  {new_time * 1000:9.1f} ms, {new_count} urls")
+    if new_time > 0:
+        print(f"  speedup: {legacy_time / new_time:.1f}x")
+
+
+class LegacyPageWriter(PDFMultiPageWriter):
+    """旧实现：每个条目三次 insert_text 加一次 draw_line，右对齐文本每次重新测量宽度（仅用于对比）"""
+
+    def _add_page_content(self, page, contents, page_num, lines_per_page, style):
+        page_width = page.rect.width
+        for i, content in enumerate(contents):
+            if len(content) < 2:
+                continue
+            y_pos = style['margin_top'] + (i * style['line_spacing'])
+            page.insert_text((style['margin_left'], y_pos), f"{i + page_num * lines_per_page + 1}.",
+                             fontname=style['fontname'], fontsize=style['fontsize'] * 0.8, color=style['text_color'])
+            left_x = style['margin_left'] + 30
+            page.insert_text((left_x, y_pos), str(content[0]),
+                             fontname=style['fontname'], fontsize=style['fontsize'], color=style['text_color'])
+            right_text = str(content[1])
+            right_x = page_width - style['margin_right'] - fitz.get_text_length(
+                right_text, style['fontname'], style['fontsize'])
+            page.insert_text((right_x, y_pos), right_text,
+                             fontname=style['fontname'], fontsize=style['fontsize'], color=style['text_color'])
+            if i < len(contents) - 1:
+                line_y = y_pos + style['line_spacing'] * 0.8
+                page.draw_line((left_x, line_y), (page_width - style['margin_right'], line_y),
+                               color=style['line_color'], width=style['line_width'], dashes=style['line_dashes'])
+
+
+def bench_writer(doc):
+    """对比新旧两种生目录排版方式每秒能写入的条目数"""
+
+    entries = [[item[1][:72], item[2]] for item in doc.get_toc()]
+    entries += [[f"Section {n} synthetic entry", n // 3 + 1] for n in range(len(entries), WRITER_ENTRIES)]
+    style = {'fontsize': 12, 'line_spacing': 28, 'margin_top': 90, 'margin_bottom': 60, 'line_dashes': "[3 2]"}
+
+    print(f"writer: {len(entries)} entries")
+    for label, writer_class in (('insert_text per item', LegacyPageWriter), ('batched per page', PDFMultiPageWriter)):
+        writer = writer_class()
+        start = time.perf_counter()
+        writer.add_content(entries, title="Raw ToC", style=style)
+        data = writer.doc.tobytes()
+        elapsed = time.perf_counter() - start
+        writer.doc.close()
+        print(f"  {label:<21} {elapsed * 1000:9.1f} ms, {len(entries) / elapsed:9.0f} entries/s, "
+              f"{len(data) / 1024:.0f} KiB")
+
+
+BENCHMARKS = {
+    'urls': bench_urls,
+    'writer': bench_writer,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    document = fitz.open(sys.argv[1])
+    for name in sys.argv[2:] or BENCHMARKS:
+        BENCHMARKS[name](document)
@@ -2,6 +2,8 @@
 这个文件是所有实现阅读器主要功能的函数的集合
 """
 
+import functools
+import hashlib
 import json
 import os.path
 import re
@@ -10,66 +12,161 @@ import sys
 import fitz
 from typing import Dict
 from PyQt5.QtCore import QRectF
-from PyQt5.QtGui import QPen, QBrush, QColor
+from PyQt5.QtGui import QPen, QBrush, QColor, QImage, QPixmap
 from PyQt5.QtWidgets import QGraphicsRectItem
-from my_classes import PDFMultiPageWriter
+from my_classes import FrameBuffer, BookmarkView, PDFMultiPageWriter, fitz_lock
 
 
-def page_adjust(current_page_index: int, error_correct: int, real_page: bool):
-    """页码调整，返回页码"""
+def page_adjust(current_page_index: int, error_correct: int, real_page: bool, labels=None):
+    """页码调整，返回页码；有页码标签时返回标签"""
 
+    if real_page and labels is not None:
+        return labels.label(current_page_index)
     return current_page_index + 1 - error_correct if real_page else current_page_index + 1
 
 
-def page_jump(dest: int, error_correct: int, real_page: bool):
-    """页面跳转，返回页码下标"""
+def page_jump(dest: int, error_correct: int, real_page: bool, labels=None):
+    """页面跳转，返回页码下标；有页码标签时按标签查找，找不到则当作 PDF 页码"""
 
+    if real_page and labels is not None:
+        index = labels.index_of(str(dest))
+        return index if index is not None else dest - 1
     return dest + error_correct - 1 if real_page else dest - 1
 
 
-def focus_pages(page_list: list, error_correct: int, real_page: bool):
+def focus_pages(page_list: list, error_correct: int, real_page: bool, labels=None):
     """make focus pages, return page index"""
 
+    if real_page and labels is not None:
+        return [page_jump(page, error_correct, real_page, labels) for page in page_list]
     return [page + error_correct - 1 for page in page_list] if real_page else [page - 1 for page in page_list]
 
 
-def make_bookmark(title: str, current_page_index: int):
-    """制作书签"""
+def page_cache_key(doc_key: str, page_index: int, scale_factor: float, options: tuple = ()):
+    """生成渲染缓存键，缩放因子取 4 位小数以消除反复乘除 1.2 带来的浮点误差"""
 
-    return [f'{title}', current_page_index + 1]
+    return doc_key, page_index, round(scale_factor, 4), options
 
 
-def del_bookmark(bookmark_list: list, key_words: str):
-    """删除书签: 按关键字删除"""
+def render_page_frame(page, scale_factor: float, clip=None):
+    """按缩放因子将页面（或 clip 指定的页面区域）渲染为 FrameBuffer，可在预读线程中调用
+
+    page 可以是 fitz.Page，也可以是缓存的 fitz.DisplayList（只做光栅化，不再解析内容流）。
+    QImage 通过 samples_ptr 直接引用 Pixmap 的像素内存，不再经过 pix.samples 复制一份 bytes。
+    MuPDF 无法输出 Qt 原生的 BGRX 顺序，RGB888 是无透明通道时唯一不需要额外转换的格式，
+    QPixmap.fromImage 上传时的那一次转换是唯一的复制。
+    """
+
+    mat = fitz.Matrix(scale_factor, scale_factor)  # 创建缩放矩阵
+    with fitz_lock:
+        pix = page.get_pixmap(matrix=mat, clip=clip, alpha=False)  # 将页面转换为图像
+    img = QImage(pix.samples_ptr, pix.width, pix.height, pix.stride, QImage.Format_RGB888)
+    return FrameBuffer(pix, img, pix.stride * pix.height)
+
+
+def frame_from_shared_memory(name: str, width: int, height: int, stride: int):
+    """把渲染进程写好的共享内存块包装为 FrameBuffer，像素既不经过 pickle 也不复制"""
+
+    import ctypes  # 只在多进程渲染模式下用到，启动时不导入
+    from multiprocessing import shared_memory
+    block = shared_memory.SharedMemory(name=name)  # 附加时在界面进程登记，release 中 unlink 时注销
+    view = ctypes.c_char.from_buffer(block.buf)
+    address = ctypes.addressof(view)
+    del view  # 不保留对 buf 的导出，否则 close 时会报 BufferError
+    img = QImage(address, width, height, stride, QImage.Format_RGB888)
+    return FrameBuffer(block, img, stride * height, on_release=release_shared_memory)
+
+
+def release_shared_memory(block):
+    """关闭并删除共享内存块"""
+
+    block.close()
+    try:
+        block.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def frame_to_pixmap(frame, stats=None):
+    """将 FrameBuffer 上传为 QPixmap 并释放像素内存，同时记录本帧复制的字节数"""
+
+    pixmap = QPixmap.fromImage(frame.image)
+    if stats is not None:
+        stats.record(frame.copied + pixmap_nbytes(pixmap), frame.nbytes)
+    frame.release()
+    return pixmap
 
-    pattern = build_search_regex(key_words)
-    return [item for item in bookmark_list if not pattern.search(item[0])]
 
+def render_page(page, scale_factor: float, clip=None, stats=None):
+    """按缩放因子将页面渲染为 QPixmap"""
 
-def show_bookmarks(bookmark_list: list, error_correct: int, real_page: bool):
-    """查看书签"""
+    return frame_to_pixmap(render_page_frame(page, scale_factor, clip), stats)
 
-    show_list = []
-    for item in bookmark_list:
-        show_list.append(item[:])
-    if real_page:
-        for item in show_list:
-            item[1] -= error_correct
-    return show_list
 
+def visible_tiles(view_rect, scene_width: float, scene_height: float, tile_size: int, margin: int):
+    """返回视口（外扩 margin 像素）覆盖到的瓦片坐标 (tx, ty) 列表"""
 
-def search_bookmarks(bookmarks_list: list, key_words: str):
-    """书签搜索"""
+    x0 = max(0, int((view_rect.left() - margin) // tile_size))
+    y0 = max(0, int((view_rect.top() - margin) // tile_size))
+    x1 = min(int((scene_width - 1) // tile_size), int((view_rect.right() + margin) // tile_size))
+    y1 = min(int((scene_height - 1) // tile_size), int((view_rect.bottom() + margin) // tile_size))
+    return [(tx, ty) for ty in range(y0, y1 + 1) for tx in range(x0, x1 + 1)]
+
+
+def tile_clip(page_rect, tx: int, ty: int, tile_size: int, scale_factor: float):
+    """瓦片在页面坐标系中的裁剪矩形"""
+
+    step = tile_size / scale_factor
+    clip = fitz.Rect(page_rect.x0 + tx * step, page_rect.y0 + ty * step,
+                     page_rect.x0 + (tx + 1) * step, page_rect.y0 + (ty + 1) * step)
+    return clip & page_rect
+
+
+def prefetch_order(current_page_index: int, total_page: int, direction: int, ahead: int, behind: int):
+    """按翻页方向生成预读页码下标，离当前页越近越靠前"""
+
+    order = []
+    for step in range(1, max(ahead, behind) + 1):
+        if step <= ahead:
+            order.append(current_page_index + direction * step)
+        if step <= behind:
+            order.append(current_page_index - direction * step)
+    return [index for index in order if 0 <= index < total_page]
+
+
+def pixmap_nbytes(pixmap):
+    """估算 QPixmap 占用的字节数"""
+
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+def make_bookmark(title: str, current_page_index: int):
+    """制作书签"""
+
+    return [f'{title}', current_page_index + 1]
+
+
+def show_bookmarks(bookmark_list, error_correct: int, real_page: bool, labels=None):
+    """查看书签：返回按需换算页码的视图，不复制书签"""
+
+    return BookmarkView(bookmark_list, error_correct, real_page, labels)
+
+
+def search_bookmarks(bookmarks_list, key_words: str):
+    """书签搜索，BookmarkStore 走标题索引并复用缓存结果"""
 
     pattern = build_search_regex(key_words)
+    if hasattr(bookmarks_list, 'search'):
+        return bookmarks_list.search(key_words, pattern)
 
     result = [item for item in bookmarks_list if pattern.search(item[0])]
 
     return result
 
 
+@functools.lru_cache(maxsize=128)
 def build_search_regex(user_input):
-    """建立搜索模式"""
+    """建立搜索模式，编译结果按输入缓存"""
 
     # 用非单词字符（空格、逗号等）分割输入，过滤空字符串
     keywords = re.split(r'[\W_]+', user_input, flags=re.IGNORECASE)
@@ -96,21 +193,63 @@ def loop_list_index_dec(show_list: list, show_list_index: int):
     return show_list_index - 1 if show_list_index > 0 else len(show_list) - 1
 
 
-def save_to_json(save_file_path: str, save_data: Dict):
-    """保存数据"""
-
-    with open(save_file_path, 'w'):
-        pass
-
-    with open(save_file_path, 'w', encoding='utf-8') as file:
-        json.dump(save_data, file, ensure_ascii=False, indent=4)
+def doc_content_hash(file_path: str, block_size: int = 64 * 1024):
+    """快速局部内容哈希：文件大小加首尾各一块数据，用于在保存数据中标识文件"""
+
+    size = os.path.getsize(file_path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file_path, 'rb') as file:
+        digest.update(file.read(block_size))
+        if size > block_size:
+            file.seek(max(block_size, size - block_size))
+            digest.update(file.read(block_size))
+    return digest.hexdigest()
+
+
+def read_journal(journal_path: str):
+    """读出自动保存日志中的全部改动，可在工作线程中调用"""
+
+    entries = []
+    if not os.path.exists(journal_path):
+        return entries
+    with open(journal_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:  # 崩溃时写了一半的最后一行
+                break
+    return entries
+
+
+def apply_journal(init_data: Dict, entries: list):
+    """按顺序把日志中的改动应用到文档参数上，返回应用的条数；重复应用结果不变"""
+
+    for entry in entries:
+        key = entry['key']
+        if key == 'bookmarks':
+            if 'add' in entry:
+                init_data['bookmarks'].add(list(entry['add']))
+            elif entry['del'] in init_data['bookmarks']:
+                init_data['bookmarks'].remove(init_data['bookmarks'].titles[entry['del']])
+        elif key == 'tt view' or key == 'bt view':
+            init_data[key].value = entry['value']
+        else:
+            init_data[key] = entry['value']
+    return len(entries)
+
+
+def read_json(load_path: str):
+    """读取保存文件，文件不存在或为空时返回 None"""
+
+    if not os.path.exists(load_path) or os.path.getsize(load_path) == 0:
+        return None
+    with open(load_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
 
 
-def load_from_json(init_data: Dict, load_path: str):
-    """加载数据"""
+def apply_save_data(init_data: Dict, data: Dict):
+    """把保存数据中与文档参数同名的项写回文档参数"""
 
-    with open(load_path, 'r', encoding='utf-8') as file:
-        data = json.load(file)
     for key0 in init_data.keys():
         for key1 in data.keys():
             if key0 == key1:
@@ -120,10 +259,9 @@ def load_from_json(init_data: Dict, load_path: str):
                     init_data[key0] = data[key1]
 
 
-def extract_toc(file_path):
-    """获取目录文件通过 .get_toc() 方法得到的目录表中的非层级信息"""
+def extract_toc(doc):
+    """获取目录文件通过 .get_toc() 方法得到的目录表中的非层级信息，doc 为已打开的文档"""
 
-    doc = fitz.open(file_path)
     toc = doc.get_toc()
     op1 = [[item[1], item[2]] for item in toc]
     for item in op1:
@@ -132,15 +270,16 @@ def extract_toc(file_path):
     return op1
 
 
-def add_fitz_toc(file_path):
-    """对输入文件添加通过 get_toc 获取的目录页面并保存覆盖原文件"""
+def add_fitz_toc(doc):
+    """在已打开的文档末尾添加通过 get_toc 获取的目录页面，以增量更新方式保存，返回目录标题页的页码下标
 
-    _, form = os.path.splitext(os.path.basename(file_path))
-    parent_dir = os.path.dirname(file_path)
-    temp_file_path = os.path.join(parent_dir, 'temp_file' + form)
+    只追加新页面的对象，耗时和写盘量与目录页数成正比，与原文件大小无关；调用方需持有 fitz_lock，
+    并先用 doc.can_save_incrementally() 确认文件可以增量保存。
+    """
 
-    writer = PDFMultiPageWriter(file_path)
-    content = extract_toc(file_path)
+    raw_toc_page = doc.page_count
+    writer = PDFMultiPageWriter(doc=doc)
+    content = extract_toc(doc)
     custom_style = {
         'fontsize': 12,
         'line_spacing': 28,
@@ -153,81 +292,8 @@ def add_fitz_toc(file_path):
         title="Raw ToC",
         style=custom_style
     )
-    writer.save(temp_file_path)
-
-    os.remove(file_path)
-    os.rename(temp_file_path, file_path)
-
-
-# 超链接提取
-def extract_links(page):
-    """填充 current_links 列表为当前页面超链接信息"""
-
-    current_links = []  # 因为只提前当前页面的链接，所以每次先清空列表
-
-    # 1. 提取显式超链接（可点击区域）
-    for link in page.get_links():
-        if link["kind"] == fitz.LINK_URI:
-            # 尝试获取链接文本，这里再写一个提取文本的函数
-            link_text = extract_link_text(page, link["from"])
-            current_links.append({
-                "type": "explicit",
-                "url": link["uri"],
-                "rect": link["from"],
-                "text": link_text if link_text else link["uri"]
-            })
-
-    # 2. 提取文本中的URL（非可点击但可能是超链接）
-    text = page.get_text("text")
-    text_urls = extract_text_urls(text, page)  # 包含4条信息的元素
-    current_links.extend(text_urls)
-
-    # 3. 按位置排序链接（从上到下）
-    current_links.sort(key=lambda x: x["rect"].y0)
-
-    return current_links
-
-
-def extract_link_text(page, rect):
-    """提取链接区域内的文本"""
-
-    # 获取链接矩形区域内的所有单词
-    words = page.get_text("words", clip=rect)
-
-    # 按位置排序单词（从左到右，从上到下）
-    words.sort(key=lambda w: (w[1], w[0]))
-
-    # 合并单词形成文本
-    link_text = " ".join(word[4] for word in words)
-
-    # 清理文本（去除多余空格）
-    return re.sub(r'\s+', ' ', link_text).strip()
-
-
-def extract_text_urls(text, page):
-    """从页面文本中提取URL并确定其位置"""
-
-    urls = []
-
-    # 匹配URL的正则表达式
-    url_pattern = r'https?://[^\s\)\]]+'
-
-    # 查找所有URL
-    for match in re.finditer(url_pattern, text):
-        url = match.group()
-        # 获取URL的位置
-        areas = page.search_for(url)
-        if areas:
-            # 使用第一个匹配区域
-            rect = areas[0]
-            urls.append({
-                "type": "text",
-                "url": url,
-                "rect": rect,
-                "text": url  # 文本就是URL本身
-            })
-
-    return urls
+    writer.save_incremental()
+    return raw_toc_page
 
 
 def show_link(index, current_links, scale_factor):
@@ -240,7 +306,8 @@ def show_link(index, current_links, scale_factor):
         if len(display_text) > 50:  # 截断过长的文本
             display_text = display_text[:47] + "..."
 
-        return f"Link {index + 1}/{len(current_links)}:{display_text}", highlight_link(link["rect"], scale_factor)
+        return f"Link {index + 1}/{len(current_links)}:{display_text}", \
+            [highlight_link(rect, scale_factor) for rect in link["rects"]]
 
 
 def highlight_link(rect, scale_factor):
@@ -1,16 +1,47 @@
+import sys
+import time
+LAUNCH_TIME = time.perf_counter()  # 启动计时起点，放在其余导入之前
+PROFILE_STARTUP = '--profile-startup' in sys.argv  # 启动性能分析模式
+if PROFILE_STARTUP:
+    import startup_profile
+    startup_profile.install(LAUNCH_TIME)
+
 import copy
+import logging
+import multiprocessing
 import os
 import pdf_reader
-import webbrowser
 
 from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QImage, QPixmap, QCloseEvent, QKeyEvent, QPainter
+from PyQt5.QtGui import QPixmap, QCloseEvent, QKeyEvent, QPainter, QTransform
 from PyQt5.QtWidgets import (
-    QMainWindow, QApplication, QGraphicsScene, QGraphicsPixmapItem, QFileDialog
+    QMainWindow, QApplication, QGraphicsScene, QGraphicsPixmapItem, QFileDialog, QLabel
 )
 
 from functions import *
-from my_classes import SignalNode
+from my_classes import (
+    SignalNode, PageCache, PrefetchScheduler, NavigationScheduler, FrameStats, DisplayListCache,
+    ThreadRenderEngine, ProcessRenderEngine, LinkCatalogue, LinkScanner, TextIndexBuilder,
+    TextScanner, BookmarkStore, SaveJournal, MetadataStore, StagedLoader, OutlineTree, PageLabelMap,
+    DocumentPool
+)
+
+RENDER_OPTIONS = ('rgb', False)  # 渲染选项（颜色空间，透明通道），参与缓存键
+PREFETCH_AHEAD = 3  # 沿翻页方向预读的页数
+PREFETCH_BEHIND = 1  # 逆翻页方向预读的页数
+TILE_THRESHOLD = 4096 * 4096  # 整页渲染超过该像素数时改用瓦片渲染
+TILE_SIZE = 512  # 瓦片边长（像素）
+TILE_MARGIN = 256  # 视口外额外渲染的边距（像素）
+PREVIEW_FACTOR = 0.35  # 快速预览相对目标分辨率的比例
+SHARP_DELAY = 120  # 输入停止多少毫秒后渲染清晰页面
+HOLD_DELAY = 150  # 长按翻页时，停顿多少毫秒后渲染（需大于键盘自动重复间隔）
+LINK_SCAN_CHUNK = 50  # 全文档超链接扫描每块页数
+LINK_SCAN_PROCESS_THRESHOLD = 300  # 页数达到该值时用多进程扫描超链接（子进程启动要重新导入本模块和 PyQt5）
+JOURNAL_COMPACT_EVERY = 200  # 自动保存日志积累到该条数时压缩为快照
+SESSION_DOCUMENTS = 4  # 同时保持打开的文档数
+SESSION_IDLE_CACHE = 256 * 1024 * 1024  # 切换走的文档合计保留的页面缓存字节数
+
+logger = logging.getLogger(__name__)
 
 
 # 颜色变化曲线
@@ -33,11 +64,23 @@ class glitchReader(QMainWindow):
         bookmark_view = SignalNode('bookmark view', False)
         bookmark_search = SignalNode('bookmark search', False)
         url_search = SignalNode('url search', False)
+        doc_url_search = SignalNode('doc url search', False)
+        text_search = SignalNode('text search', False)
+        scan_search = SignalNode('scan search', False)
+        outline_view = SignalNode('outline view', False)
         tt_view = SignalNode('tt view', False)
         bt_view = SignalNode('bt view', False)
         # 信号级别关系绑定
         bookmark_view.add_mutual_signals(url_search)
+        bookmark_view.add_mutual_signals(text_search)
+        url_search.add_mutual_signals(text_search)
+        bookmark_view.add_mutual_signals(scan_search)
+        url_search.add_mutual_signals(scan_search)
+        text_search.add_mutual_signals(scan_search)
+        for signal in (bookmark_view, url_search, text_search, scan_search):
+            signal.add_mutual_signals(outline_view)
         bookmark_view.add_child_signal(bookmark_search)
+        url_search.add_child_signal(doc_url_search)
         tt_view.add_mutual_signals(bt_view)
 
         # 方便在局部初始化的变量
@@ -45,29 +88,55 @@ class glitchReader(QMainWindow):
         self.list_index = 0
         self.bookmarks_key_words = ''
         self.current_links = []
+        self.doc_links_key_words = ''
+        self.text_key_words = ''
+        self.outline_key_words = ''
         # self.display_text = ''  # 输入窗口展示的占位文本
 
         # 需要在全局初始化的变量
         self.doc_paras = {
             'doc': None,  # 打开的文件
             'doc name': '',  # 文件名
+            'file path': '',  # 文件路径
+            'content hash': '',  # 文件局部内容哈希
+            'index path': '',  # 全文索引文件路径
+            'text index': None,  # 全文索引（首次搜索时再通过 mmap 打开）
+            'index failed': False,  # 全文索引建立失败，全文搜索改用流式扫描
             'total page': 0,  # 总页数
             'current page index': 0,  # 当前页码
             # 'current page': None,  # 当前读取的页面
             'scale factor': 1.0,  # 缩放因子
             'ecn': 0,  # 页码纠错值
+            'raw toc page': None,  # 生目录标题页的页码下标
+            'outline': None,  # 大纲树（打开文件时读取）
+            'outline result': [],  # 大纲标题搜索结果
             'toc page': None,  # 目录页
-            'bookmarks': [],  # 书签
+            'bookmarks': BookmarkStore(),  # 书签
             'focus pages': [],  # focus pages
             'focus page index': 0,  # focus pages list index
-            'save file': '',  # 保存文件
-            'save path': '',  # 保存路径
+            'journal path': '',  # 自动保存日志路径
+            'last page': None,  # 上次阅读到的页码下标
+            'last scale': None,  # 上次的缩放因子
+            'last scroll': None,  # 上次的滚动条位置 [水平, 竖直]
             'bm search result': [],  # 书签搜索结果
+            'page cache': PageCache(),  # 已渲染页面缓存
+            'display lists': DisplayListCache(),  # 页面显示列表缓存
+            'page areas': {},  # 页码下标 -> 页面面积（pt²），判断瓦片模式用
+            'links cache': {},  # 页码下标 -> 该页提取出的超链接列表
+            'link catalogue': LinkCatalogue(),  # 全文档超链接目录
+            'doc links result': [],  # 全文档超链接筛选结果
+            'text search result': [],  # 全文搜索结果
+            'scan search result': [],  # 流式扫描结果，按找到的先后顺序排列
             # 信号组
             'real page': False,  # 显示真实页码
+            'page labels': None,  # 页码标签表（PDF 有 /PageLabels 时）
             'bm view': bookmark_view,  # 显示书签
             'bm search': bookmark_search,  # 显示书签搜索结果
             'url search': url_search,  # 显示超链接搜索结果
+            'doc url search': doc_url_search,  # 显示全文档超链接
+            'text search': text_search,  # 显示全文搜索结果
+            'scan search': scan_search,  # 显示流式扫描结果
+            'outline view': outline_view,  # 显示大纲
             'tt view': tt_view,  # 置顶置顶视图
             'bt view': bt_view,  # 置底置顶视图
             'save mode': True,  # 自动保存
@@ -75,6 +144,32 @@ class glitchReader(QMainWindow):
         }
         self.doc_paras_copy = copy.deepcopy(self.doc_paras)  # copy参数字典用于操作
 
+        # 预读
+        self.flip_direction = 1  # 最近一次翻页方向：1 向后，-1 向前
+        self.prefetcher = PrefetchScheduler(ThreadRenderEngine(render_page_frame))
+        self.prefetcher.page_ready.connect(self.on_page_prefetched)
+        self.frame_stats = FrameStats()  # 渲染帧复制字节统计
+        self.link_scanner = LinkScanner(LINK_SCAN_CHUNK, LINK_SCAN_PROCESS_THRESHOLD)  # 全文档超链接扫描
+        self.link_scanner.chunk_ready.connect(self.on_links_scanned)
+        self.index_builder = TextIndexBuilder(LINK_SCAN_PROCESS_THRESHOLD)  # 全文索引构建
+        self.index_builder.finished.connect(self.on_index_built)
+        self.text_scanner = TextScanner()  # 不建索引的流式扫描
+        # 数据保存目录，所有文档的保存数据都在其中的 SQLite 文件里
+        self.save_folder = os.path.join(os.path.expanduser("~"), "Documents", "Glitch Reader save data")
+        os.makedirs(self.save_folder, exist_ok=True)
+        self.metadata = MetadataStore(os.path.join(self.save_folder, 'metadata.sqlite3'))
+        self.journal = SaveJournal(self.metadata.save)  # 自动保存日志，压缩时写入元数据存储
+        self.previous_writer = None  # 上一个文件仍在写盘的日志线程
+        self.opener = StagedLoader()  # 分阶段异步打开文件
+        self.sessions = DocumentPool(SESSION_DOCUMENTS, SESSION_IDLE_CACHE)  # 切换走但仍打开的文档
+        self.opener.stage_done.connect(self.on_open_stage)
+        self.opener.stage_failed.connect(self.on_open_failed)
+        self.open_started = 0.0  # 本次打开开始的时刻
+        self.open_timings = []  # 本次打开各阶段耗时 [(阶段名, 秒)]
+        self.launch_logged = False  # 是否已记录启动到可阅读的耗时
+        self.text_scanner.hit_found.connect(self.on_scan_hit)
+        self.text_scanner.finished.connect(self.on_scan_finished)
+
         # 键盘信号
         self.is_ctrl_pressed = False
         self.is_shift_pressed = False
@@ -88,9 +183,21 @@ class glitchReader(QMainWindow):
 
         self.ui.graphicsView.setRenderHints(QPainter.Antialiasing | QPainter.SmoothPixmapTransform)
         self.pixmap_item = None
+        self.tile_items = {}  # 瓦片模式下当前场景中的瓦片 (tx, ty) -> QGraphicsPixmapItem
+        self.tiled = False  # 当前页是否以瓦片模式显示
+        self.rendered_scale = 1.0  # 场景中图像实际对应的缩放因子
+        self.preview_pending = False  # 场景中是预览图像，等待替换为清晰页面
+        self.key_repeating = False  # 当前按键是否处于长按自动重复
+        self.navigator = NavigationScheduler(self.render_navigation, self)  # 合并翻页/缩放请求
+        self.page_overlay = QLabel(self.ui.graphicsView)  # 长按翻页时显示的页码浮层
+        self.page_overlay.setStyleSheet('background-color: rgba(0, 0, 0, 160); color: white; padding: 6px;')
+        self.page_overlay.hide()
+        self.ui.graphicsView.horizontalScrollBar().valueChanged.connect(self.update_tiles)
+        self.ui.graphicsView.verticalScrollBar().valueChanged.connect(self.update_tiles)
         self.resize(1920, 1080)
 
-        self.add_image(resource_path('cat.png'))
+        if not file_path:  # 直接打开文件时不加载占位图片
+            self.add_image(resource_path('cat.png'))
 
         self.ui.open_button.clicked.connect(self.open_file_dialog)  # open按钮绑定打开文件方法
 
@@ -129,51 +236,245 @@ class glitchReader(QMainWindow):
         if file_path:
             self.open_file(file_path)
 
-    # 打开一个文件的时候需要执行的操作
+    # 打开一个文件的时候需要执行的操作：保存旧文件与打开新文件并行，新文件分阶段在工作线程中加载，
+    # 先显示续读页，再依次载入保存数据和后台索引，界面线程只负责把各阶段结果放进文档参数
     def open_file(self, file_path):
-        # 如果此时还有文件未关闭，则处理保存后，将文件参数重新初始化
-        if self.doc_paras_copy['doc']:
-            if self.doc_paras_copy['save mode']:
-                save_data = {
-                    "toc page": self.doc_paras_copy['toc page'],  # 目录页
-                    "bookmarks": self.doc_paras_copy['bookmarks'],  # 书签
-                    "tt view": self.doc_paras_copy['tt view'].value,  # 置顶置顶视图
-                    "bt view": self.doc_paras_copy['bt view'].value,  # 置底置顶视图
-                    "ecn": self.doc_paras_copy['ecn'],  # 页码纠错值
-                }
-                save_to_json(self.doc_paras_copy['save path'], save_data)
-                self.doc_paras_copy['doc'].close()
+        if os.path.abspath(file_path) == self.doc_paras_copy['file path'] and self.doc_paras_copy['doc'] is not None:
+            self.statusBar().showMessage('already open', 2000)  # 不能把正在阅读的文档放入会话池再打开一份
+            return
+        if os.path.abspath(file_path) in self.sessions:  # 仍在会话池中的文档直接切换回去
+            self.switch_document(os.path.abspath(file_path))
+            return
+        self.open_started = time.perf_counter()
+        self.open_timings = []
+        # 旧文件提交保存后放入会话池，将文件参数重新初始化；旧文件的日志线程在后台写完
+        self.park_document()
+        previous_writer = self.previous_writer
         self.doc_paras_copy = copy.deepcopy(self.doc_paras)
 
-        # 传递具体的文件参数
+        # 传递具体的文件参数，先显示占位
+        self.doc_paras_copy['file path'] = os.path.abspath(file_path)
         self.doc_paras_copy['doc name'], form = os.path.splitext(os.path.basename(file_path))
         self.setWindowTitle(self.doc_paras_copy['doc name'])
-        data_load_flag = False
+        self.scene.clear()
+        self.ui.everything_edit.clear()
+        self.ui.everything_edit.setPlaceholderText('Opening...')
 
-        # 创建数据保存路径和文件
-        self.doc_paras_copy['save file'] = self.doc_paras_copy['doc name'] + '.json'  # 设置保存文件名称
-        save_folder = os.path.join(os.path.expanduser("~"), "Documents", "Glitch Reader save data")
-        if not os.path.exists(save_folder):
-            os.makedirs(save_folder)
-        self.doc_paras_copy['save path'] = os.path.join(save_folder, self.doc_paras_copy['save file'])  # 设置保存文件路径
-        if not os.path.exists(self.doc_paras_copy['save path']):  # 若不存在保存文件则创建空.json文件
-            # if form == '.pdf':
-            #     add_fitz_toc(file_path)  # 将 get_toc 获取的目录加入当前文件
-            with open(self.doc_paras_copy['save path'], 'w', encoding='utf-8'):
-                pass
-        else:
-            if os.path.getsize(self.doc_paras_copy['save path']) > 0:
-                load_from_json(self.doc_paras_copy, self.doc_paras_copy['save path'])
-                dic = self.doc_paras_copy
-                if not (dic['toc page'] is None and not dic['bookmarks'] and not dic['tt view'].value
-                        and not dic['bt view'] and dic['ecn'] == 0):
-                    data_load_flag = True
+        file_path = self.doc_paras_copy['file path']
+        doc_name = self.doc_paras_copy['doc name']
+        scale_factor = self.doc_paras_copy['scale factor']
+
+        def open_document(context):  # 打开文件，与旧文件的保存同时进行
+            with fitz_lock:
+                context['doc'] = fitz.open(file_path)
 
-        # 读取数据后再打开文件
-        self.doc_paras_copy['doc'] = fitz.open(file_path)
-        self.doc_paras_copy['total page'] = self.doc_paras_copy['doc'].page_count
+        def load_resume(context):  # 按内容哈希查出续读页
+            if previous_writer is not None:  # 重新打开同一文件时要读到旧文件刚保存的数据
+                previous_writer.join()
+            context['hash'] = doc_content_hash(file_path)
+            context['known'] = self.metadata.touch(context['hash'], doc_name, file_path)
+            context['data'] = self.metadata.load(context['hash']) if context['known'] else None
+            return context['hash']
 
+        def render_first_page(context):  # 续读页的显示列表和图像，页数用于校正续读页
+            doc = context['doc']
+            data = context['data'] or {}
+            last_page = data.get('last page')
+            resume_scale = data.get('last scale') or scale_factor
+            with fitz_lock:
+                page_count = doc.page_count
+                page_index = min(last_page, page_count - 1) if last_page is not None and last_page > 0 else 0
+                page = doc.load_page(page_index)
+                display_list = page.get_displaylist()
+                rules = doc.get_page_labels()
+            labels = PageLabelMap(rules, page_count) if rules else None
+            rect = display_list.rect
+            frame = None
+            if rect.width * rect.height * resume_scale ** 2 <= TILE_THRESHOLD:  # 瓦片模式由界面线程按视口渲染
+                frame = render_page_frame(display_list, resume_scale)
+            return doc, page_count, page_index, resume_scale, (page, display_list), frame, labels
+
+        def load_metadata(context):  # 保存数据、旧版 .json 数据和日志
+            legacy_path = os.path.join(self.save_folder, doc_name + '.json')
+            legacy = None if context['known'] else (read_json(legacy_path), read_journal(legacy_path + '.journal'))
+            journal_path = os.path.join(self.save_folder, context['hash'] + '.journal')
+            return context['data'], legacy, journal_path, read_journal(journal_path)
+
+        def load_outline(context):  # 大纲只读取一次，之后的导航和章节查找都在内存中进行
+            with fitz_lock:
+                toc = context['doc'].get_toc(simple=True)
+            return OutlineTree(toc)
+
+        def check_indexes(context):  # 全文索引是否已经建立
+            index_path = os.path.join(self.save_folder, context['hash'] + '.idx')
+            return index_path, os.path.exists(index_path)
+
+        self.opener.start([
+            ('document', open_document),
+            ('resume', load_resume),
+            ('first page', render_first_page),
+            ('metadata', load_metadata),
+            ('outline', load_outline),
+            ('indexes', check_indexes),
+        ])
+
+    # 把当前文档放入会话池：压缩日志写入快照、停下后台任务，文档句柄和缓存保留；
+    # 还没载入保存数据的文档不能放入（切换回来后会用空数据覆盖保存），直接关闭
+    def park_document(self):
+        paras = self.doc_paras_copy
+        if paras['doc'] is not None and paras['journal path'] and paras['save mode']:
+            self.journal.compact(self.save_data())
+        self.previous_writer = self.journal.close(wait=False) or self.previous_writer
+        self.opener.cancel()
+        self.prefetcher.cancel_all()
+        self.link_scanner.cancel()
+        self.index_builder.cancel()
+        self.text_scanner.cancel()
+        if paras['doc'] is None:
+            return
+        paras['last scroll'] = [self.ui.graphicsView.horizontalScrollBar().value(),
+                                self.ui.graphicsView.verticalScrollBar().value()]
+        if not paras['journal path']:
+            self.close_document(paras)
+            return
+        for evicted in self.sessions.park(paras['file path'], paras):
+            self.close_document(evicted)
+
+    # 关闭会话池移出的文档：释放句柄、缓存和全文索引的 mmap
+    def close_document(self, paras):
+        logger.info('close %s', paras['doc name'])
+        with fitz_lock:
+            paras['doc'].close()
+        paras['page cache'].clear()
+        paras['display lists'].clear()
+        if paras['text index'] is not None:
+            paras['text index'].close()
+            paras['text index'] = None
+
+    # 切换到会话池中的文档：句柄和缓存都还在，直接显示上次的位置，再续上未完成的后台任务
+    def switch_document(self, file_path):
+        paras = self.sessions.take(file_path)
+        if paras is None:
+            return
+        started = time.perf_counter()
+        self.park_document()
+        if self.previous_writer is not None:  # 同一文档的日志不能有两个线程同时写
+            self.previous_writer.join()
+            self.previous_writer = None
+        self.doc_paras_copy = paras
+        self.list_index = 0
+        self.setWindowTitle(paras['doc name'])
+        self.ui.everything_edit.clear()
+        self.journal.open(paras['content hash'], paras['journal path'])
+        self.prefetcher.open(paras['file path'])
         self.show_page()
+        if paras['last scroll']:
+            QTimer.singleShot(0, lambda scroll=paras['last scroll']: self.restore_scroll(scroll))
+        self.change_button_style()
+        self.change_toc_light()
+        self.text_select_and_display()
+        if not paras['link catalogue'].complete:  # 扫描到一半被切走的目录重新扫描
+            paras['link catalogue'] = LinkCatalogue()
+            self.start_background_indexes(paras['index path'], os.path.exists(paras['index path']))
+        elif not os.path.exists(paras['index path']):
+            self.index_builder.start(paras['file path'], paras['index path'], paras['total page'])
+        logger.info('switch to %s: %.1f ms', paras['doc name'], (time.perf_counter() - started) * 1000)
+
+    # 会话中的文档名，当前文档在前，其余按最近使用排列
+    def session_names(self):
+        names = [self.sessions.sessions[path]['doc name'] for path in self.sessions.paths()]
+        if self.doc_paras_copy['doc'] is not None:
+            names.insert(0, self.doc_paras_copy['doc name'] + '*')
+        return names
+
+    # 续读页显示后记录耗时：第一次打开记录从启动开始的时间，之后记录从选择文件开始的时间
+    def log_readable(self):
+        now = time.perf_counter()
+        if not self.launch_logged:
+            self.launch_logged = True
+            logger.info('launch to readable page: %.1f ms', (now - LAUNCH_TIME) * 1000)
+            if PROFILE_STARTUP:
+                startup_profile.mark('readable page')
+                startup_profile.report()
+        logger.info('open %s: readable in %.1f ms', self.doc_paras_copy['doc name'], (now - self.open_started) * 1000)
+
+    # 恢复上次的滚动条位置（需等场景尺寸生效后再设置）
+    def restore_scroll(self, scroll):
+        self.ui.graphicsView.horizontalScrollBar().setValue(scroll[0])
+        self.ui.graphicsView.verticalScrollBar().setValue(scroll[1])
+
+    # 打开文件的某个阶段完成：把结果放进文档参数
+    def on_open_stage(self, generation, name, result, seconds):
+        if generation != self.opener.generation:
+            return
+        self.open_timings.append((name, seconds))
+        logger.info('open %s: %s %.1f ms', self.doc_paras_copy['doc name'], name, seconds * 1000)
+        if name == 'resume':
+            self.doc_paras_copy['content hash'] = result
+        elif name == 'first page':
+            doc, page_count, page_index, resume_scale, entry, frame, labels = result
+            self.doc_paras_copy['doc'] = doc
+            self.doc_paras_copy['total page'] = page_count
+            self.doc_paras_copy['page labels'] = labels
+            self.doc_paras_copy['real page'] = labels is not None  # 有页码标签时默认显示标签
+            self.doc_paras_copy['current page index'] = page_index
+            self.doc_paras_copy['scale factor'] = resume_scale
+            self.doc_paras_copy['display lists'].put(page_index, entry)
+            if frame is not None:
+                pixmap = frame_to_pixmap(frame, self.frame_stats)
+                key = page_cache_key(self.doc_paras_copy['file path'], page_index, resume_scale, RENDER_OPTIONS)
+                self.doc_paras_copy['page cache'].put(key, pixmap, pixmap_nbytes(pixmap))
+            self.prefetcher.open(self.doc_paras_copy['file path'])  # 显示后立即预读相邻页
+            self.show_page()
+            self.text_select_and_display()
+            self.log_readable()
+        elif name == 'metadata':
+            self.apply_open_metadata(*result)
+        elif name == 'outline':
+            self.doc_paras_copy['outline'] = result
+            if self.doc_paras_copy['outline view'].value and self.outline_key_words:  # 大纲载入前输入的搜索
+                self.run_outline_search()
+            self.text_select_and_display()
+        elif name == 'indexes':
+            self.start_background_indexes(*result)
+            total = time.perf_counter() - self.open_started
+            logger.info('open %s: ready in %.1f ms', self.doc_paras_copy['doc name'], total * 1000)
+            self.statusBar().showMessage(f'opened in {total * 1000:.0f} ms', 2000)
+
+    def on_open_failed(self, generation, name, message):
+        if generation != self.opener.generation:
+            return
+        logger.error('open %s failed at %s: %s', self.doc_paras_copy['file path'], name, message)
+        self.ui.everything_edit.setPlaceholderText(f'Open failed: {message}')
+
+    # 载入保存数据：首次打开时迁移旧版 .json 数据，再重放日志，并为新文件开始记日志
+    def apply_open_metadata(self, data, legacy, journal_path, journal_entries):
+        current_page_index = self.doc_paras_copy['current page index']
+        data_load_flag = False
+        if data is not None:
+            apply_save_data(self.doc_paras_copy, data)
+        elif legacy is not None and legacy[0] is not None:
+            apply_save_data(self.doc_paras_copy, legacy[0])
+        self.doc_paras_copy['current page index'] = current_page_index  # 续读页已经显示，保存数据不再改动它
+        if self.doc_paras_copy['last scroll']:
+            QTimer.singleShot(0, lambda scroll=self.doc_paras_copy['last scroll']: self.restore_scroll(scroll))
+
+        if not isinstance(self.doc_paras_copy['bookmarks'], BookmarkStore):  # 保存数据中读出的是列表
+            self.doc_paras_copy['bookmarks'] = BookmarkStore(self.doc_paras_copy['bookmarks'])
+        if legacy is not None:
+            apply_journal(self.doc_paras_copy, legacy[1])
+        # 重放上次会话快照之后的改动（包括异常退出前记下的改动）
+        apply_journal(self.doc_paras_copy, journal_entries)
+        self.doc_paras_copy['journal path'] = journal_path
+        self.journal.open(self.doc_paras_copy['content hash'], journal_path)
+        self.previous_writer = None
+        if legacy is not None and legacy[0] is not None:
+            self.journal.compact(self.save_data())  # 迁移结果写入元数据存储
+
+        dic = self.doc_paras_copy
+        if not (dic['toc page'] is None and not dic['bookmarks'] and not dic['tt view'].value
+                and not dic['bt view'] and dic['ecn'] == 0):
+            data_load_flag = True
         self.change_button_style()
         if data_load_flag:
             self.ui.everything_edit.setPlaceholderText('Data has been loaded')
@@ -182,6 +483,17 @@ class glitchReader(QMainWindow):
         else:
             self.text_select_and_display()
 
+    # 开始后台超链接扫描，首次打开时在后台建立全文索引
+    def start_background_indexes(self, index_path, index_exists):
+        self.doc_paras_copy['index path'] = index_path
+        self.doc_paras_copy['link catalogue'].total_pages = self.doc_paras_copy['total page']
+        self.link_scanner.start(self.doc_paras_copy['file path'], self.doc_paras_copy['total page'])
+        if not index_exists:
+            self.doc_paras_copy['index failed'] = False
+            self.index_builder.start(self.doc_paras_copy['file path'], index_path, self.doc_paras_copy['total page'])
+        if self.doc_paras_copy['toc page'] is not None:  # 预热续读页附近和目录页
+            self.prefetch_neighbours(extra=[self.doc_paras_copy['toc page']])
+
     # 根据 current_page_index 属性读取页面并添加到场景显示
     def show_page(self):
         document = self.doc_paras_copy['doc']
@@ -189,15 +501,30 @@ class glitchReader(QMainWindow):
             # 获取当前页面
             scale_factor = self.doc_paras_copy['scale factor']
             current_page_index = self.doc_paras_copy['current page index']
-            current_page = document[current_page_index]
+            self.navigator.cancel()
+            self.preview_pending = False
+            self.page_overlay.hide()
+            self.ui.graphicsView.resetTransform()
+            self.rendered_scale = scale_factor
 
-            # 根据当前缩放因子获取页面的 Pixmap
-            mat = fitz.Matrix(scale_factor, scale_factor)  # 创建缩放矩阵
-            pix = current_page.get_pixmap(matrix=mat)  # 将页面转换为图像
+            # 整页像素过大时只渲染视口附近的瓦片；已缓存的整页图像不会超过阈值，命中时不经过 MuPDF
+            key = page_cache_key(self.doc_paras_copy['file path'], current_page_index, scale_factor, RENDER_OPTIONS)
+            if (key not in self.doc_paras_copy['page cache']
+                    and self.page_area(current_page_index) * scale_factor ** 2 > TILE_THRESHOLD):
+                page_rect = self.display_list(current_page_index).rect
+                width, height = page_rect.width * scale_factor, page_rect.height * scale_factor
+                self.scene.clear()
+                self.tile_items = {}
+                self.tiled = True
+                self.scene.setSceneRect(0, 0, width, height)
+                self.update_tiles()
+                self.prefetch_neighbours()
+                return
+            self.tiled = False
+            self.tile_items = {}
 
-            # 创建 QImage
-            img = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888)
-            pixmap = QPixmap.fromImage(img)
+            # 根据当前缩放因子获取页面的 Pixmap（优先读取缓存）
+            pixmap = self.page_pixmap(current_page_index, scale_factor)
 
             # 清除场景
             self.scene.clear()
@@ -209,18 +536,295 @@ class glitchReader(QMainWindow):
             # 设置场景大小
             self.scene.setSceneRect(0, 0, pixmap.width(), pixmap.height())
 
+            self.prefetch_neighbours()
+
+    # 页面面积只用于判断是否改用瓦片渲染：按页缓存，读 cropbox 不解析内容流（旋转不改变面积）
+    def page_area(self, page_index: int):
+        areas = self.doc_paras_copy['page areas']
+        if page_index not in areas:
+            with fitz_lock:
+                rect = self.doc_paras_copy['doc'].page_cropbox(page_index)
+            areas[page_index] = rect.width * rect.height
+        return areas[page_index]
+
+    # 获取指定页面的 QPixmap：命中缓存则跳过 MuPDF，未命中则渲染后写入缓存
+    def page_pixmap(self, page_index: int, scale_factor: float):
+        cache = self.doc_paras_copy['page cache']
+        key = page_cache_key(self.doc_paras_copy['file path'], page_index, scale_factor, RENDER_OPTIONS)
+        pixmap = cache.get(key)
+        if pixmap is None:
+            frame = self.prefetcher.take(key)  # 正在预读该页时直接等待预读结果
+            if frame is not None:
+                pixmap = frame_to_pixmap(frame, self.frame_stats)
+            else:
+                pixmap = render_page(self.display_list(page_index), scale_factor, stats=self.frame_stats)
+            cache.put(key, pixmap, pixmap_nbytes(pixmap))
+        return pixmap
+
+    # 取页面的超链接：每页只提取一次，之后循环浏览链接直接读缓存（缓存随文件切换清空）
+    def page_links(self, page_index: int):
+        links_cache = self.doc_paras_copy['links cache']
+        if page_index not in links_cache:
+            page = self.doc_paras_copy['display lists'].get(self.doc_paras_copy['doc'], page_index)[0]
+            with fitz_lock:
+                from links import extract_links  # 超链接提取在第一次浏览链接时才导入
+                links_cache[page_index] = extract_links(page)
+        return links_cache[page_index]
+
+    # 全文档超链接扫描完成一块：并入目录，正在浏览全文档链接时刷新显示
+    def on_links_scanned(self, generation, results, pages):
+        if generation != self.link_scanner.generation:
+            return
+        self.doc_paras_copy['link catalogue'].add_chunk(results, pages)
+        if self.doc_paras_copy['doc url search'].value:
+            self.text_select_and_display()
+
+    # 全文索引建立完成：正在全文搜索时用新索引重新查询
+    def on_index_built(self, generation, index_path):
+        if generation != self.index_builder.generation:
+            return
+        self.index_builder.cancel()
+        if not index_path:
+            self.doc_paras_copy['index failed'] = True
+            self.statusBar().showMessage('failed to build text index, using scan', 2000)
+            if self.doc_paras_copy['text search'].value:  # 正在等待索引的全文搜索改用流式扫描
+                self.fall_back_to_scan()
+                self.text_select_and_display()
+        elif self.doc_paras_copy['text search'].value:
+            self.run_text_search()
+            self.text_select_and_display()
+
+    # 按需通过 mmap 打开全文索引，索引尚未建立时返回 None
+    def load_text_index(self):
+        if self.doc_paras_copy['text index'] is None and os.path.exists(self.doc_paras_copy['index path']):
+            from text_index import TextIndex
+            try:
+                self.doc_paras_copy['text index'] = TextIndex(self.doc_paras_copy['index path'])
+            except (OSError, ValueError):  # 索引文件损坏或版本不符时重新建立
+                os.remove(self.doc_paras_copy['index path'])
+                self.doc_paras_copy['index failed'] = False
+                self.index_builder.start(self.doc_paras_copy['file path'], self.doc_paras_copy['index path'],
+                                         self.doc_paras_copy['total page'])
+        return self.doc_paras_copy['text index']
+
+    # 执行全文搜索，结果按相关度排序，并跳转到第一个结果所在页
+    def run_text_search(self):
+        index = self.load_text_index()
+        self.doc_paras_copy['text search result'] = index.search(self.text_key_words) if index is not None else []
+        self.list_index = 0
+        self.jump_to_text_hit(self.doc_paras_copy['text search result'])
+
+    # 全文索引建立失败时，全文搜索改用不建索引的流式扫描
+    def fall_back_to_scan(self):
+        self.doc_paras_copy['scan search'].open_signal()
+        self.run_scan_search()
+
+    # 开始流式扫描，新查询会取消上一次扫描
+    def run_scan_search(self):
+        self.doc_paras_copy['scan search result'] = []
+        self.list_index = 0
+        self.text_scanner.start(self.doc_paras_copy['file path'], build_search_regex(self.text_key_words),
+                                self.doc_paras_copy['current page index'])
+
+    # 扫描到新的命中页：第一处命中立即跳转，之后只更新计数
+    def on_scan_hit(self, generation, page_index, rects):
+        if generation != self.text_scanner.generation:
+            return
+        self.doc_paras_copy['scan search result'].append((page_index, rects, 0.0))
+        if not self.doc_paras_copy['scan search'].value:
+            return
+        if len(self.doc_paras_copy['scan search result']) == 1:
+            self.jump_to_text_hit(self.doc_paras_copy['scan search result'])
+        self.text_select_and_display()
+
+    def on_scan_finished(self, generation, hits):
+        if generation != self.text_scanner.generation:
+            return
+        self.text_scanner.running = False
+        if self.doc_paras_copy['scan search'].value:
+            self.statusBar().showMessage(f'scan finished: {hits} pages matched', 2000)
+            self.text_select_and_display()
+
+    # 跳转到当前搜索结果所在页
+    def jump_to_text_hit(self, results):
+        if results and results[self.list_index][0] != self.doc_paras_copy['current page index']:
+            self.jump_to_page(results[self.list_index][0])
+
+    # 显示当前搜索结果，并高亮该页所有命中的单词；pending 为结果尚未就绪时的提示
+    def show_text_hit(self, results, pending=None):
+        if pending is not None and not results:
+            return pending
+        if not results:
+            return 'No Match.'
+        page_index, rects, _ = results[self.list_index]
+        if page_index == self.doc_paras_copy['current page index']:
+            for rect in rects:
+                self.scene.addItem(highlight_link(fitz.Rect(rect), self.doc_paras_copy['scale factor']))
+        self.ui.everything_edit.setStyleSheet('background-color: #fff3c4; color: black;')
+        page_num = page_adjust(page_index, self.doc_paras_copy['ecn'], self.doc_paras_copy['real page'],
+                               self.page_labels())
+        more = '+' if self.doc_paras_copy['scan search'].value and self.text_scanner.running else ''
+        return f"Hit {self.list_index + 1}/{len(results)}{more} p{page_num}: {self.text_key_words}"
+
+    # 取页面的显示列表（首次访问时解析内容流并缓存），之后的各种缩放和裁剪只需光栅化
+    def display_list(self, page_index: int):
+        return self.doc_paras_copy['display lists'].get(self.doc_paras_copy['doc'], page_index)[1]
+
+    # 渐进显示：缓存未命中时先显示低分辨率预览，输入停顿 SHARP_DELAY 毫秒后再渲染清晰页面
+    def show_page_progressive(self):
+        document = self.doc_paras_copy['doc']
+        if document:
+            scale_factor = self.doc_paras_copy['scale factor']
+            current_page_index = self.doc_paras_copy['current page index']
+            key = page_cache_key(self.doc_paras_copy['file path'], current_page_index, scale_factor, RENDER_OPTIONS)
+            if key in self.doc_paras_copy['page cache'] or key in self.prefetcher.pending:
+                self.show_page()
+                return
+            if self.page_area(current_page_index) * scale_factor ** 2 > TILE_THRESHOLD:
+                self.show_page()
+                return
+
+            page = self.display_list(current_page_index)
+            width, height = page.rect.width * scale_factor, page.rect.height * scale_factor
+            pixmap = render_page(page, scale_factor * PREVIEW_FACTOR, stats=self.frame_stats)
+            self.scene.clear()
+            self.tile_items = {}
+            self.tiled = False
+            self.ui.graphicsView.resetTransform()
+            self.rendered_scale = scale_factor
+            pixmap_item = QGraphicsPixmapItem(pixmap)
+            pixmap_item.setTransformationMode(Qt.SmoothTransformation)
+            pixmap_item.setScale(1 / PREVIEW_FACTOR)  # 拉伸到目标尺寸，高亮等场景坐标保持不变
+            self.scene.addItem(pixmap_item)
+            self.scene.setSceneRect(0, 0, width, height)
+            self.preview_pending = True
+            self.navigator.request(SHARP_DELAY)
+
+    # 渲染清晰页面并刷新页码和高亮
+    def refresh_page(self):
+        self.show_page()
+        self.text_select_and_display()
+
+    # 翻页请求统一交给导航调度：长按时只更新页码浮层，停顿或松开按键后才渲染最终页面
+    def navigate(self):
+        if self.key_repeating:
+            self.show_page_overlay()
+            self.navigator.request(HOLD_DELAY, held=True)
+        else:
+            self.navigator.request(0)
+
+    # 导航调度到期后的渲染：长按结束或预览待替换时直接渲染清晰页面，否则走渐进显示
+    def render_navigation(self, held: bool):
+        if held or self.preview_pending:
+            self.refresh_page()
+        else:
+            self.show_page_progressive()
+            self.text_select_and_display()
+
+    # 显示长按翻页时的页码浮层
+    def show_page_overlay(self):
+        page_num = page_adjust(self.doc_paras_copy['current page index'],
+                               self.doc_paras_copy['ecn'], self.doc_paras_copy['real page'], self.page_labels())
+        self.page_overlay.setText(f"{page_num}/{self.doc_paras_copy['total page']}")
+        self.page_overlay.adjustSize()
+        self.page_overlay.move(self.ui.graphicsView.width() - self.page_overlay.width() - 30, 20)
+        self.page_overlay.show()
+        self.page_overlay.raise_()
+
+    # 缩放预览：先用视图变换直接放缩已有图像，输入停顿后再按新缩放因子渲染
+    def preview_zoom(self):
+        if self.doc_paras_copy['doc'] is None:
+            return
+        scale_factor = self.doc_paras_copy['scale factor']
+        key = page_cache_key(self.doc_paras_copy['file path'], self.doc_paras_copy['current page index'],
+                             scale_factor, RENDER_OPTIONS)
+        if key in self.doc_paras_copy['page cache']:
+            self.show_page()
+            return
+        ratio = scale_factor / self.rendered_scale
+        self.ui.graphicsView.setTransform(QTransform.fromScale(ratio, ratio))
+        self.preview_pending = True
+        self.navigator.request(SHARP_DELAY, held=self.key_repeating)
+
+    # 瓦片模式：补齐视口（含边距）内缺少的瓦片，移除视口外的瓦片，内存占用与缩放倍数无关
+    def update_tiles(self):
+        if not self.tiled or self.preview_pending:  # 缩放预览期间场景坐标与缩放因子不一致
+            return
+        page_index = self.doc_paras_copy['current page index']
+        scale_factor = self.doc_paras_copy['scale factor']
+        page = None  # 只在有瓦片未命中缓存时才取显示列表
+        cache = self.doc_paras_copy['page cache']
+        scene_rect = self.scene.sceneRect()
+        view_rect = self.ui.graphicsView.mapToScene(self.ui.graphicsView.viewport().rect()).boundingRect()
+
+        wanted = visible_tiles(view_rect, scene_rect.width(), scene_rect.height(), TILE_SIZE, TILE_MARGIN)
+        for tile in [tile for tile in self.tile_items if tile not in wanted]:
+            self.scene.removeItem(self.tile_items.pop(tile))
+        for tx, ty in wanted:
+            if (tx, ty) in self.tile_items:
+                continue
+            key = page_cache_key(self.doc_paras_copy['file path'], page_index, scale_factor,
+                                 RENDER_OPTIONS + ('tile', tx, ty))
+            pixmap = cache.get(key)
+            if pixmap is None:
+                if page is None:
+                    page = self.display_list(page_index)
+                clip = tile_clip(page.rect, tx, ty, TILE_SIZE, scale_factor)
+                pixmap = render_page(page, scale_factor, clip, self.frame_stats)
+                cache.put(key, pixmap, pixmap_nbytes(pixmap))
+            item = QGraphicsPixmapItem(pixmap)
+            item.setPos(tx * TILE_SIZE, ty * TILE_SIZE)
+            self.scene.addItem(item)
+            self.tile_items[(tx, ty)] = item
+
+    # 按最近的翻页方向预读当前页前后的页面，离开预读窗口的旧任务会被取消
+    def prefetch_neighbours(self, extra=()):  # extra: 额外预读的页码下标，排在相邻页之后
+        if self.tiled:  # 瓦片模式下整页预读会占用大量内存
+            self.prefetcher.cancel_all()
+            return
+        scale_factor = self.doc_paras_copy['scale factor']
+        cache = self.doc_paras_copy['page cache']
+        jobs = []
+        for page_index in prefetch_order(self.doc_paras_copy['current page index'],
+                                         self.doc_paras_copy['total page'], self.flip_direction,
+                                         PREFETCH_AHEAD, PREFETCH_BEHIND) + list(extra):
+            key = page_cache_key(self.doc_paras_copy['file path'], page_index, scale_factor, RENDER_OPTIONS)
+            if key not in cache:
+                jobs.append((key, page_index, scale_factor))
+        self.prefetcher.schedule(jobs)
+
+    # 预读完成后写入缓存（运行在界面线程）
+    def on_page_prefetched(self, key, generation, engine, result):
+        frame = self.prefetcher.accept(key, generation, engine, result)
+        if frame is None:
+            return
+        cache = self.doc_paras_copy['page cache']
+        if key[0] == self.doc_paras_copy['file path'] and key not in cache:
+            pixmap = frame_to_pixmap(frame, self.frame_stats)
+            cache.put(key, pixmap, pixmap_nbytes(pixmap))
+        else:
+            frame.release()
+
+    # 远距离跳转（页码跳转、书签、目录等）：先作废旧位置附近尚未完成的预读任务
+    def jump_to_page(self, page_index: int):
+        if abs(page_index - self.doc_paras_copy['current page index']) > max(PREFETCH_AHEAD, PREFETCH_BEHIND):
+            self.prefetcher.cancel_all()
+        self.doc_paras_copy['current page index'] = page_index
+        self.show_page()
+
     # 放缩页面
     def zoom_in(self):
         self.doc_paras_copy['scale factor'] *= 1.2
-        self.show_page()
+        self.preview_zoom()
 
     def zoom_out(self):
         # if self.doc_paras_copy['scale factor'] >= 1.2:
         self.doc_paras_copy['scale factor'] /= 1.2
-        self.show_page()
+        self.preview_zoom()
 
     # 键盘按键监听
     def keyPressEvent(self, a0: QKeyEvent) -> None:
+        self.key_repeating = a0.isAutoRepeat()
         if a0.key() == Qt.Key_Control:
             self.is_ctrl_pressed = True
         elif a0.key() == Qt.Key_X:
@@ -232,8 +836,7 @@ class glitchReader(QMainWindow):
             self.ui.everything_edit.setFocus()
         elif a0.key() == Qt.Key_Z and self.is_ctrl_pressed:
             if self.from_input_change is not None:
-                self.doc_paras_copy['current page index'] = self.from_input_change
-                self.show_page()
+                self.jump_to_page(self.from_input_change)
                 self.text_select_and_display()
                 self.from_input_change = None
         elif a0.key() == Qt.Key_Up or a0.key() == Qt.Key_W:  # Up/W
@@ -251,8 +854,15 @@ class glitchReader(QMainWindow):
         elif a0.key() == Qt.Key_Escape:  # Esc
             self.handle_escape_key()
 
+    def resizeEvent(self, a0):
+        super().resizeEvent(a0)
+        self.update_tiles()
+
     def keyReleaseEvent(self, event):
         """处理按键释放事件，重置修饰键状态"""
+        if not event.isAutoRepeat() and self.key_repeating:  # 长按结束，立即渲染最终页面
+            self.key_repeating = False
+            self.navigator.flush()
         if event.key() == Qt.Key_Control:
             self.is_ctrl_pressed = False
         elif event.key() == Qt.Key_Shift:
@@ -272,6 +882,16 @@ class glitchReader(QMainWindow):
                     self.list_index = loop_list_index_dec(self.doc_paras_copy['bm search result'], self.list_index)
                 else:
                     self.list_index = loop_list_index_dec(self.doc_paras_copy['bookmarks'], self.list_index)
+            elif self.doc_paras_copy['outline view'].value:
+                self.list_index = loop_list_index_dec(self.outline_entries(), self.list_index)
+            elif self.doc_paras_copy['text search'].value:
+                self.list_index = loop_list_index_dec(self.doc_paras_copy['text search result'], self.list_index)
+                self.jump_to_text_hit(self.doc_paras_copy['text search result'])
+            elif self.doc_paras_copy['scan search'].value:
+                self.list_index = loop_list_index_dec(self.doc_paras_copy['scan search result'], self.list_index)
+                self.jump_to_text_hit(self.doc_paras_copy['scan search result'])
+            elif self.doc_paras_copy['doc url search'].value:
+                self.list_index = loop_list_index_dec(self.doc_paras_copy['doc links result'], self.list_index)
             elif self.doc_paras_copy['url search'].value:
                 self.list_index = loop_list_index_dec(self.current_links, self.list_index)
             self.text_select_and_display()
@@ -289,6 +909,16 @@ class glitchReader(QMainWindow):
                     self.list_index = loop_list_index_inc(self.doc_paras_copy['bm search result'], self.list_index)
                 else:
                     self.list_index = loop_list_index_inc(self.doc_paras_copy['bookmarks'], self.list_index)
+            elif self.doc_paras_copy['outline view'].value:
+                self.list_index = loop_list_index_inc(self.outline_entries(), self.list_index)
+            elif self.doc_paras_copy['text search'].value:
+                self.list_index = loop_list_index_inc(self.doc_paras_copy['text search result'], self.list_index)
+                self.jump_to_text_hit(self.doc_paras_copy['text search result'])
+            elif self.doc_paras_copy['scan search'].value:
+                self.list_index = loop_list_index_inc(self.doc_paras_copy['scan search result'], self.list_index)
+                self.jump_to_text_hit(self.doc_paras_copy['scan search result'])
+            elif self.doc_paras_copy['doc url search'].value:
+                self.list_index = loop_list_index_inc(self.doc_paras_copy['doc links result'], self.list_index)
             elif self.doc_paras_copy['url search'].value:
                 self.list_index = loop_list_index_inc(self.current_links, self.list_index)
             self.text_select_and_display()
@@ -299,7 +929,9 @@ class glitchReader(QMainWindow):
 
     def handle_left_key(self):
         """处理左箭头键逻辑"""
-        if self.is_ctrl_pressed:
+        if self.is_shift_pressed and self.doc_paras_copy['outline view'].value:  # 折叠，已折叠时回到上一级
+            self.outline_collapse()
+        elif self.is_ctrl_pressed:
             self.ui.graphicsView.horizontalScrollBar().setValue(
                 self.ui.graphicsView.horizontalScrollBar().value() - 80 * int(self.doc_paras_copy['scale factor'])
             )
@@ -311,13 +943,15 @@ class glitchReader(QMainWindow):
                     self.ui.graphicsView.verticalScrollBar().maximum()
                 )
             if self.doc_paras_copy['current page index'] > 0:
+                self.flip_direction = -1
                 self.doc_paras_copy['current page index'] -= 1
-                self.show_page()
-                self.text_select_and_display()
+                self.navigate()
 
     def handle_right_key(self):
         """处理右箭头键逻辑"""
-        if self.is_ctrl_pressed:
+        if self.is_shift_pressed and self.doc_paras_copy['outline view'].value:  # 展开下一级
+            self.outline_expand()
+        elif self.is_ctrl_pressed:
             self.ui.graphicsView.horizontalScrollBar().setValue(
                 self.ui.graphicsView.horizontalScrollBar().value() + 80 * int(self.doc_paras_copy['scale factor'])
             )
@@ -325,9 +959,9 @@ class glitchReader(QMainWindow):
             if self.doc_paras_copy['tt view'].value or self.doc_paras_copy['bt view'].value:
                 self.ui.graphicsView.verticalScrollBar().setValue(0)
             if self.doc_paras_copy['current page index'] < self.doc_paras_copy['total page'] - 1:
+                self.flip_direction = 1
                 self.doc_paras_copy['current page index'] += 1
-                self.show_page()
-                self.text_select_and_display()
+                self.navigate()
 
     def handle_enter_key(self):
         """处理回车键逻辑"""
@@ -343,14 +977,21 @@ class glitchReader(QMainWindow):
             if self.doc_paras_copy['bm view'].value:
                 if self.doc_paras_copy['bm search'].value:
                     if self.doc_paras_copy['bm search result']:
-                        self.doc_paras_copy['current page index'] \
-                            = int(self.doc_paras_copy['bm search result'][self.list_index][1]) - 1
-                        self.show_page()
+                        self.jump_to_page(int(self.doc_paras_copy['bm search result'][self.list_index][1]) - 1)
                 else:
                     if self.doc_paras_copy['bookmarks']:
-                        self.doc_paras_copy['current page index'] \
-                            = int(self.doc_paras_copy['bookmarks'][self.list_index][1]) - 1
-                        self.show_page()
+                        self.jump_to_page(int(self.doc_paras_copy['bookmarks'][self.list_index][1]) - 1)
+            elif self.doc_paras_copy['outline view'].value:  # 跳转到大纲项的目标页
+                entries = self.outline_entries()
+                if entries and self.doc_paras_copy['outline'].pages[entries[self.list_index]] >= 0:
+                    self.jump_to_page(self.doc_paras_copy['outline'].pages[entries[self.list_index]])
+            elif self.doc_paras_copy['doc url search'].value:  # 先跳转到链接所在页，已在该页时再打开链接
+                results = self.doc_paras_copy['doc links result']
+                if results:
+                    if results[self.list_index][0] != self.doc_paras_copy['current page index']:
+                        self.jump_to_page(results[self.list_index][0])
+                    else:
+                        self.open_current_link()
             elif self.doc_paras_copy['url search'].value:
                 self.open_current_link()
 
@@ -359,9 +1000,7 @@ class glitchReader(QMainWindow):
     def handle_tab_key(self):
         """处理Tab键逻辑"""
         if self.doc_paras_copy['focus pages']:
-            self.doc_paras_copy['current page index'] \
-                = self.doc_paras_copy['focus pages'][self.doc_paras_copy['focus page index']]
-            self.show_page()
+            self.jump_to_page(self.doc_paras_copy['focus pages'][self.doc_paras_copy['focus page index']])
             self.text_select_and_display()
             self.doc_paras_copy['focus page index'] \
                 = loop_list_index_inc(self.doc_paras_copy['focus pages'], self.doc_paras_copy['focus page index'])
@@ -373,12 +1012,14 @@ class glitchReader(QMainWindow):
             self.ui.everything_edit.clearFocus()
         else:
             self.clear_highlights()
+            self.text_scanner.cancel()  # Esc 立即停止流式扫描
             self.doc_paras_copy['bm view'].check_close_signal()
             self.list_index = 0
             self.text_select_and_display()
 
     # 鼠标事件监听
     def mousePressEvent(self, event):
+        self.key_repeating = False
         if event.button() == Qt.LeftButton:  # 左键往回翻页
             self.handle_left_key()
         elif event.button() == Qt.RightButton:  # 右键往后翻页
@@ -395,26 +1036,115 @@ class glitchReader(QMainWindow):
             elif delta < 0:
                 self.zoom_out()
 
+    # 把文件自带的目录（get_toc）排版成页面，以增量更新方式追加到当前文件末尾
+    def make_raw_toc(self):
+        doc = self.doc_paras_copy['doc']
+        if doc is None or self.doc_paras_copy['raw toc page'] is not None:
+            return
+        with fitz_lock:
+            if not doc.get_toc():
+                self.statusBar().showMessage('no outline to write', 2000)
+                return
+            if not doc.can_save_incrementally():  # 修复过或加密方式不支持时只能整体重写，不做
+                self.statusBar().showMessage('file cannot be saved incrementally', 2000)
+                return
+        if self.doc_paras_copy['save mode']:
+            self.journal.compact(self.save_data())
+        self.journal.close()
+        try:
+            with fitz_lock:
+                page_count = doc.page_count
+                try:
+                    raw_toc_page = add_fitz_toc(doc)
+                except Exception:
+                    if doc.page_count > page_count:  # 保存失败时撤掉已经加到内存中的目录页
+                        doc.delete_pages(page_count, doc.page_count - 1)
+                    raise
+                self.doc_paras_copy['total page'] = doc.page_count
+                if self.doc_paras_copy['page labels'] is not None:  # 追加的页沿用最后一条标签规则
+                    self.doc_paras_copy['page labels'] = PageLabelMap(doc.get_page_labels(), doc.page_count)
+
+            # 文件内容变了，保存数据、日志和全文索引都转到新的内容哈希下
+            old_hash = self.doc_paras_copy['content hash']
+            new_hash = doc_content_hash(self.doc_paras_copy['file path'])
+            self.metadata.rekey(old_hash, new_hash)
+            for path in (self.doc_paras_copy['journal path'], self.doc_paras_copy['index path']):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.doc_paras_copy['content hash'] = new_hash
+            self.doc_paras_copy['journal path'] = os.path.join(self.save_folder, new_hash + '.journal')
+            self.doc_paras_copy['index path'] = os.path.join(self.save_folder, new_hash + '.idx')
+            if self.doc_paras_copy['text index'] is not None:
+                self.doc_paras_copy['text index'].close()
+                self.doc_paras_copy['text index'] = None
+        except Exception as error:  # 文件不可写、加密或保存出错时只提示，不让异常穿出按键事件
+            logger.exception('make raw toc failed: %s', self.doc_paras_copy['file path'])
+            self.statusBar().showMessage(f'failed to write raw toc: {error}', 3000)
+            return
+        finally:  # 无论成功与否都重新开始记日志（成功时已换到新的内容哈希）
+            self.journal.open(self.doc_paras_copy['content hash'], self.doc_paras_copy['journal path'])
+        self.doc_paras_copy['raw toc page'] = raw_toc_page
+        self.journal_record('raw toc page', value=raw_toc_page)
+
+        engine = self.prefetcher.engine  # 预读引擎的句柄还停留在追加前的页数，重建引擎让它重新打开文件
+        self.prefetcher.set_engine(ProcessRenderEngine(engine.workers, frame_from_shared_memory)
+                                   if isinstance(engine, ProcessRenderEngine) else ThreadRenderEngine(render_page_frame))
+        self.doc_paras_copy['link catalogue'] = LinkCatalogue()
+        self.start_background_indexes(self.doc_paras_copy['index path'], False)
+        self.jump_to_page(raw_toc_page)
+        self.text_select_and_display()
+
+    # 需要保存的数据
+    def save_data(self):
+        return {
+            "toc page": self.doc_paras_copy['toc page'],  # 目录页
+            "raw toc page": self.doc_paras_copy['raw toc page'],  # 生目录页
+            "bookmarks": self.doc_paras_copy['bookmarks'].to_list(),  # 书签
+            "tt view": self.doc_paras_copy['tt view'].value,  # 置顶置顶视图
+            "bt view": self.doc_paras_copy['bt view'].value,  # 置底置顶视图
+            "ecn": self.doc_paras_copy['ecn'],  # 页码纠错值
+            "last page": self.doc_paras_copy['current page index'],  # 阅读位置
+            "last scale": self.doc_paras_copy['scale factor'],  # 缩放因子
+            "last scroll": [self.ui.graphicsView.horizontalScrollBar().value(),
+                            self.ui.graphicsView.verticalScrollBar().value()],  # 滚动条位置
+        }
+
+    # 记录一条改动到自动保存日志，关闭自动保存时不记录；日志过长时压缩为快照
+    def journal_record(self, key: str, **change):
+        if not self.doc_paras_copy['save mode']:
+            return
+        self.journal.record({'key': key, **change})
+        if self.journal.pending >= JOURNAL_COMPACT_EVERY:
+            self.journal.compact(self.save_data())
+
     # 重载关闭窗口函数
     def closeEvent(self, a0: QCloseEvent) -> None:
         if self.doc_paras_copy['doc'] is not None:
             if self.doc_paras_copy['save mode']:
-                # 需要保存的数据
-                save_data = {
-                    "toc page": self.doc_paras_copy['toc page'],  # 目录页
-                    "bookmarks": self.doc_paras_copy['bookmarks'],  # 书签
-                    "tt view": self.doc_paras_copy['tt view'].value,  # 置顶置顶视图
-                    "bt view": self.doc_paras_copy['bt view'].value,  # 置底置顶视图
-                    "ecn": self.doc_paras_copy['ecn'],  # 页码纠错值
-                }
-                save_to_json(self.doc_paras_copy['save path'], save_data)
+                self.journal.compact(self.save_data())
+        self.journal.close()
+        if self.previous_writer is not None:
+            self.previous_writer.join()
+        for paras in self.sessions.drain():  # 会话池中的文档切换走时已经保存
+            self.close_document(paras)
+        self.opener.shutdown()
+        self.metadata.close()
+        self.prefetcher.shutdown()
+        self.link_scanner.cancel()
+        self.index_builder.cancel()
+        self.text_scanner.cancel()
         a0.accept()
 
     # 在浏览器中打开当前显示的链接
     def open_current_link(self):
-        if self.list_index >= 0 and self.current_links:
-            link = self.current_links[self.list_index]
+        if self.doc_paras_copy['doc url search'].value:
+            links = [{"url": entry[2]} for entry in self.doc_paras_copy['doc links result']]
+        else:
+            links = self.current_links
+        if 0 <= self.list_index < len(links):
+            link = links[self.list_index]
             try:
+                import webbrowser  # 很少使用，用到时才导入
                 webbrowser.open(link["url"])
                 self.statusBar().showMessage(f"directing: {link['url']}", 2000)
             except Exception as e:
@@ -473,7 +1203,7 @@ class glitchReader(QMainWindow):
                 if self.doc_paras_copy['bm search'].value:  # 搜索书签
                     search_result = search_bookmarks(self.doc_paras_copy['bookmarks'], self.bookmarks_key_words)
                     show_result = show_bookmarks(search_result, self.doc_paras_copy['ecn'],
-                                                 self.doc_paras_copy['real page'])
+                                                 self.doc_paras_copy['real page'], self.page_labels())
                     self.doc_paras_copy['bm search result'] = search_result
                     if search_result:  # 有搜到
                         self.ui.everything_edit.setStyleSheet(
@@ -488,67 +1218,181 @@ class glitchReader(QMainWindow):
                         text = 'No Match.'
                 else:  # 展示全部书签
                     self.ui.everything_edit.setStyleSheet("background-color:#c8dbe3; color:purple;")
-                    show_list = show_bookmarks(self.doc_paras_copy['bookmarks'],
-                                               self.doc_paras_copy['ecn'], self.doc_paras_copy['real page'])
+                    show_list = show_bookmarks(self.doc_paras_copy['bookmarks'], self.doc_paras_copy['ecn'],
+                                               self.doc_paras_copy['real page'], self.page_labels())
                     text = f"[{show_list[self.list_index][0]}, {show_list[self.list_index][1]}]"
+        elif self.doc_paras_copy['outline view'].value:  # 大纲
+            text = self.show_outline()
+        elif self.doc_paras_copy['text search'].value:  # 全文搜索
+            pending = 'Indexing...' if self.doc_paras_copy['text index'] is None else None
+            text = self.show_text_hit(self.doc_paras_copy['text search result'], pending)
+        elif self.doc_paras_copy['scan search'].value:  # 流式扫描
+            pending = 'Scanning...' if self.text_scanner.running else None
+            text = self.show_text_hit(self.doc_paras_copy['scan search result'], pending)
+        elif self.doc_paras_copy['doc url search'].value:  # 全文档超链接
+            text = self.show_doc_link()
         elif self.doc_paras_copy['url search'].value:  # 搜索超链接
-            page = self.doc_paras_copy['doc'][self.doc_paras_copy['current page index']]
-            self.current_links = extract_links(page)
+            self.current_links = self.page_links(self.doc_paras_copy['current page index'])
             if self.current_links:
-                text, rect_item = show_link(self.list_index, self.current_links, self.doc_paras_copy['scale factor'])
+                text, rect_items = show_link(self.list_index, self.current_links, self.doc_paras_copy['scale factor'])
                 self.ui.everything_edit.setStyleSheet("color: blue; text-decoration: underline;")
-                self.scene.addItem(rect_item)
+                for rect_item in rect_items:  # 跨行的 URL 每行一个高亮框
+                    self.scene.addItem(rect_item)
             else:
                 text = 'No Links.'
         else:  # 显示页码
             self.ui.everything_edit.setStyleSheet("background-color:white; color:black;")
-            page_num = page_adjust(self.doc_paras_copy['current page index'],
-                                   self.doc_paras_copy['ecn'], self.doc_paras_copy['real page'])
-            if page_num < 1:
+            page_num = page_adjust(self.doc_paras_copy['current page index'], self.doc_paras_copy['ecn'],
+                                   self.doc_paras_copy['real page'], self.page_labels())
+            if isinstance(page_num, int) and page_num < 1:
                 text = f"before text/{self.doc_paras_copy['total page']}"
             else:
                 text = f"{page_num}/{self.doc_paras_copy['total page']}"
+            outline = self.doc_paras_copy['outline']
+            if outline is not None:  # 附带当前所在章节
+                section = outline.section_at(self.doc_paras_copy['current page index'])
+                if section >= 0:
+                    text += f"  {outline.titles[section]}"
 
         self.ui.everything_edit.setPlaceholderText(text)
 
+    # 生效的页码标签表：PDF 没有标签或手动设置了页码纠错值时为 None，按 ecn 换算
+    def page_labels(self):
+        if self.doc_paras_copy['ecn'] != 0:
+            return None
+        return self.doc_paras_copy['page labels']
+
+    # 输入是某页的页码标签时返回其页码下标
+    def label_index(self, input_text: str):
+        labels = self.page_labels()
+        if labels is None or not self.doc_paras_copy['real page']:
+            return None
+        return labels.index_of(input_text)
+
+    # 大纲视图中可浏览的节点：有搜索关键字时为搜索结果，否则为当前可见的行
+    def outline_entries(self):
+        outline = self.doc_paras_copy['outline']
+        if outline is None:
+            return []
+        if self.outline_key_words:
+            return self.doc_paras_copy['outline result']
+        return outline.rows()
+
+    # 打开大纲视图，定位到当前页所在章节
+    def open_outline(self):
+        outline = self.doc_paras_copy['outline']
+        self.outline_key_words = ''
+        self.list_index = 0
+        if outline is not None:
+            section = outline.section_at(self.doc_paras_copy['current page index'])
+            if section >= 0:
+                outline.reveal(section)
+                self.list_index = outline.rows().index(section)
+
+    # 搜索大纲标题；大纲尚未载入时先记下关键字，载入阶段完成后再搜索
+    def run_outline_search(self):
+        outline = self.doc_paras_copy['outline']
+        if outline is not None:
+            self.doc_paras_copy['outline result'] = outline.search(self.outline_key_words,
+                                                                   build_search_regex(self.outline_key_words))
+        self.list_index = 0
+
+    def outline_expand(self):
+        entries = self.outline_entries()
+        if entries and not self.outline_key_words:
+            self.doc_paras_copy['outline'].expand(entries[self.list_index])
+        self.text_select_and_display()
+
+    def outline_collapse(self):
+        entries = self.outline_entries()
+        if entries and not self.outline_key_words:
+            outline = self.doc_paras_copy['outline']
+            node = entries[self.list_index]
+            if node in outline.expanded:
+                outline.collapse(node)
+            elif outline.parents[node] >= 0:
+                node = outline.parents[node]
+                outline.collapse(node)
+            self.list_index = outline.rows().index(node)
+        self.text_select_and_display()
+
+    # 显示大纲中的当前项：缩进表示层级，+ 可展开，- 已展开
+    def show_outline(self):
+        outline = self.doc_paras_copy['outline']
+        if outline is None:
+            return 'Loading outline...'
+        entries = self.outline_entries()
+        if not entries:
+            return 'No Match.' if self.outline_key_words else 'No outline.'
+        node = entries[self.list_index]
+        self.ui.everything_edit.setStyleSheet("background-color:#e6e0f0; color:#402060;")
+        page = outline.pages[node]
+        page_num = page_adjust(page, self.doc_paras_copy['ecn'], self.doc_paras_copy['real page'], self.page_labels())
+        page_text = f" p{page_num}" if page >= 0 else ''
+        if self.outline_key_words:
+            return f"Hit {self.list_index + 1}/{len(entries)}: {outline.titles[node]}{page_text}"
+        marker = '-' if node in outline.expanded else '+' if outline.children[node] else ' '
+        return f"{'  ' * (outline.levels[node] - 1)}{marker} {outline.titles[node]}{page_text}"
+
+    # 显示全文档超链接筛选结果中的当前项，链接在当前页时高亮
+    def show_doc_link(self):
+        catalogue = self.doc_paras_copy['link catalogue']
+        pattern = build_search_regex(self.doc_links_key_words)
+        results = [entry for entry in catalogue.entries if pattern.search(entry[2]) or pattern.search(entry[4])]
+        self.doc_paras_copy['doc links result'] = results
+        progress = '' if catalogue.complete else f" ({catalogue.pages_scanned}/{catalogue.total_pages})"
+        if not results:
+            return f"Scanning...{progress}" if not catalogue.complete else 'No Links.'
+        if self.list_index >= len(results):
+            self.list_index = 0
+
+        page_index, _, _, rects, display_text = results[self.list_index]
+        if len(display_text) > 50:  # 截断过长的文本
+            display_text = display_text[:47] + "..."
+        if page_index == self.doc_paras_copy['current page index']:
+            for rect in rects:
+                self.scene.addItem(highlight_link(fitz.Rect(rect), self.doc_paras_copy['scale factor']))
+        self.ui.everything_edit.setStyleSheet("color: blue; text-decoration: underline;")
+        page_num = page_adjust(page_index, self.doc_paras_copy['ecn'], self.doc_paras_copy['real page'],
+                               self.page_labels())
+        return f"Link {self.list_index + 1}/{len(results)}{progress} p{page_num}:{display_text}"
+
     # 处理输入窗口的用户输入
     def match_input(self, input_text: str):
         if re.search(r'real page\s*:?\s*(\d+)*\s*', input_text):  # 匹配占位符显示真实页数
             real = re.search(r'real page\s*:?\s*(\d+)*\s*', input_text).group(1)
             if real is not None:
                 self.doc_paras_copy['ecn'] = self.doc_paras_copy['current page index'] + 1 - int(real)
+                self.journal_record('ecn', value=self.doc_paras_copy['ecn'])
             self.doc_paras_copy['real page'] = True
             self.text_select_and_display()
         elif re.search(r'pdf page\s*', input_text):  # 匹配显示pdf页数
             self.doc_paras_copy['real page'] = False
             self.text_select_and_display()
-        elif re.search(r'(^\d+$)\s*', input_text):  # 页码跳转
-            self.doc_paras_copy['current page index'] = page_jump(
-                int(re.search(r'(^\d+$)\s*', input_text).group(1)),
-                self.doc_paras_copy['ecn'], self.doc_paras_copy['real page']
-            )
-            self.show_page()
-            self.text_select_and_display()
+        elif re.search(r'^make raw toc\s*$', input_text):  # 在文件末尾追加生目录
+            self.make_raw_toc()
         elif re.search(r'^raw toc\s*$', input_text):  # 生目录跳转
             if self.doc_paras_copy['raw toc page'] is not None:
-                self.doc_paras_copy['current page index'] = self.doc_paras_copy['raw toc page']
-                self.show_page()
+                self.jump_to_page(self.doc_paras_copy['raw toc page'])
                 self.text_select_and_display()
         elif re.search(r'set\s+toc\s*', input_text):  # 设置目录
             self.doc_paras_copy['toc page'] = self.doc_paras_copy['current page index']
+            self.journal_record('toc page', value=self.doc_paras_copy['toc page'])
             self.change_toc_light()
         elif re.search(r'del\s+toc\s*', input_text):  # 删除目录
             self.doc_paras_copy['toc page'] = None
+            self.journal_record('toc page', value=None)
             self.change_toc_light()
         elif re.search(r'^toc\s*$', input_text):  # 跳转目录
-            self.doc_paras_copy['current page index'] = self.doc_paras_copy['toc page']
-            self.show_page()
+            if self.doc_paras_copy['toc page'] is not None:
+                self.jump_to_page(self.doc_paras_copy['toc page'])
             self.text_select_and_display()
         elif re.search(r'focus\s*:?\s*(\d+(?:[ ,]\d+)*)', input_text):  # focus pages
             self.doc_paras_copy['focus pages'].clear()
             page_list = [int(num) for num in re.search(r'focus\s*:?\s*(\d+(?:[ ,]\d+)*)',
                                                        input_text).group(1).replace(',', ' ').split()]
-            focus_list = focus_pages(page_list, self.doc_paras_copy['ecn'], self.doc_paras_copy['real page'])
+            focus_list = focus_pages(page_list, self.doc_paras_copy['ecn'], self.doc_paras_copy['real page'],
+                                     self.page_labels())
             self.doc_paras_copy['focus pages'] = focus_list
         elif re.search(r'^bm\s*$', input_text):  # 查看书签
             self.doc_paras_copy['bm view'].update_signal()
@@ -557,49 +1401,157 @@ class glitchReader(QMainWindow):
         elif re.search(r'add\s+bm\s*:?\s*(.*)', input_text):  # 添加书签
             bm_title = re.search(r'add\s+bm\s*:?\s*(.*)', input_text).group(1)
             bm = make_bookmark(bm_title, self.doc_paras_copy['current page index'])
-            if not any(item[0] == bm_title for item in self.doc_paras_copy['bookmarks']):
-                self.doc_paras_copy['bookmarks'].append(bm)
-                self.doc_paras_copy['bookmarks'].sort(key=lambda x: x[1])
+            if self.doc_paras_copy['bookmarks'].add(bm):
+                self.journal_record('bookmarks', add=bm[:])
                 self.blank_blink(255)
                 self.text_select_and_display()
         elif re.search(r'del\s+bm\s*:?\s*(.*)?\s*', input_text):  # 删除书签
             key_words = re.search(r'del\s+bm\s*:?\s*(.*)?\s*', input_text).group(1)
-            if key_words is None:
-                if any(item[1] == self.doc_paras_copy['current page index'] + 1
-                       for item in self.doc_paras_copy['bookmarks']):
-                    self.doc_paras_copy['bookmarks'] = [item for item in self.doc_paras_copy['bookmarks']
-                                                        if item[1] != self.doc_paras_copy['current page index'] + 1]
+            if not key_words.strip():  # 不带关键字时只删除当前页的书签
+                removed = self.doc_paras_copy['bookmarks'].on_page(self.doc_paras_copy['current page index'] + 1)
             else:
-                self.doc_paras_copy['bookmarks'] = del_bookmark(self.doc_paras_copy['bookmarks'], key_words)
+                removed = search_bookmarks(self.doc_paras_copy['bookmarks'], key_words)
+            for item in list(removed):
+                self.doc_paras_copy['bookmarks'].remove(item)
+                self.journal_record('bookmarks', **{'del': item[0]})
             self.list_index = loop_list_index_inc(self.doc_paras_copy['bookmarks'], self.list_index)
             self.blank_blink(0)
             self.text_select_and_display()
+        elif re.search(r'^ol\s*$', input_text):  # 大纲视图
+            self.doc_paras_copy['outline view'].update_signal()
+            if self.doc_paras_copy['outline view'].value:
+                self.open_outline()
+            self.text_select_and_display()
+        elif re.search(r'^ol\s*:\s*(.+)$', input_text):  # 搜索大纲标题
+            self.doc_paras_copy['outline view'].open_signal()
+            self.outline_key_words = re.search(r'^ol\s*:\s*(.+)$', input_text).group(1).strip()
+            self.run_outline_search()
+            self.text_select_and_display()
+        elif re.search(r'^scan\s*:\s*(.+)$', input_text):  # 不建索引的流式扫描
+            self.doc_paras_copy['scan search'].open_signal()
+            self.text_key_words = re.search(r'^scan\s*:\s*(.+)$', input_text).group(1).strip()
+            self.run_scan_search()
+            self.text_select_and_display()
+        elif re.search(r'^find\s*:\s*(.+)$', input_text):  # 全文搜索
+            self.doc_paras_copy['text search'].open_signal()
+            self.text_key_words = re.search(r'^find\s*:\s*(.+)$', input_text).group(1).strip()
+            if self.doc_paras_copy['index failed']:
+                self.fall_back_to_scan()
+            else:
+                self.run_text_search()
+            self.text_select_and_display()
         elif re.search(r'find bm\s*:?\s*(.*)\s*', input_text):  # 搜索书签
             self.doc_paras_copy['bm search'].open_signal()
             self.list_index = 0
             self.bookmarks_key_words = re.search(r'find bm\s*:?\s*(.*)\s*', input_text).group(1)
             self.text_select_and_display()
+        elif re.search(r'^urls\s*:?\s*(.*)$', input_text):  # 全文档超链接，可附带筛选关键字
+            key_words = re.search(r'^urls\s*:?\s*(.*)$', input_text).group(1).strip()
+            if key_words:
+                self.doc_paras_copy['doc url search'].open_signal()
+            else:
+                self.doc_paras_copy['doc url search'].update_signal()
+            self.doc_links_key_words = key_words
+            self.list_index = 0
+            self.text_select_and_display()
         elif re.search(r'^url\s*$', input_text):  # 搜索超链接
             self.doc_paras_copy['url search'].update_signal()
             self.list_index = 0
             self.text_select_and_display()
         elif re.search(r'^tt$\s*', input_text):  # tt view
             self.doc_paras_copy['tt view'].update_signal()
+            self.journal_record('tt view', value=self.doc_paras_copy['tt view'].value)  # 两者互斥，一起记录
+            self.journal_record('bt view', value=self.doc_paras_copy['bt view'].value)
             self.change_button_style()
         elif re.search(r'^bt$\s*', input_text):  # bt view
             self.doc_paras_copy['bt view'].update_signal()
+            self.journal_record('tt view', value=self.doc_paras_copy['tt view'].value)  # 两者互斥，一起记录
+            self.journal_record('bt view', value=self.doc_paras_copy['bt view'].value)
             self.change_button_style()
         elif re.search(r'^save\s*$', input_text):  # auto save
             self.doc_paras_copy['save mode'] = True
+            self.journal.compact(self.save_data())  # 关闭期间的改动没有记日志，先写一次快照
             self.change_button_style()
         elif re.search(r'no save\s*', input_text):  # no save
             self.doc_paras_copy['save mode'] = False
             self.change_button_style()
+        elif re.search(r'^cache\s*:?\s*(\d+)?\s*$', input_text):  # 页面缓存预算（MB）/ 命中统计
+            budget = re.search(r'^cache\s*:?\s*(\d+)?\s*$', input_text).group(1)
+            cache = self.doc_paras_copy['page cache']
+            if budget is not None:
+                self.doc_paras['page cache'].set_budget(int(budget) * 1024 * 1024)  # 之后打开的文件沿用该预算
+                cache.set_budget(int(budget) * 1024 * 1024)
+            self.statusBar().showMessage(
+                f"cache: {cache.current_bytes // (1024 * 1024)}/{cache.max_bytes // (1024 * 1024)} MB, "
+                f"{len(cache)} pages, hits {cache.hits}, misses {cache.misses}", 3000)
+        elif re.search(r'^frames\s*$', input_text):  # 每帧复制字节统计
+            stats = self.frame_stats
+            self.statusBar().showMessage(
+                f"frames {stats.frames}, last {stats.last_frame_copied // 1024} KB copied, "
+                f"total {stats.bytes_copied // (1024 * 1024)} MB copied, "
+                f"{stats.bytes_avoided // (1024 * 1024)} MB avoided", 3000)
+        elif re.search(r'^mp\s*:?\s*(\d+)\s*$', input_text):  # 多进程渲染引擎：工作进程数，0 为单线程
+            workers = int(re.search(r'^mp\s*:?\s*(\d+)\s*$', input_text).group(1))
+            if workers > 0:
+                self.prefetcher.set_engine(ProcessRenderEngine(workers, frame_from_shared_memory))
+            else:
+                self.prefetcher.set_engine(ThreadRenderEngine(render_page_frame))
+            self.prefetch_neighbours()
+            self.statusBar().showMessage(f"render engine: {workers} processes" if workers else
+                                         "render engine: thread", 2000)
+        elif re.search(r'^nav\s*$', input_text):  # 导航调度统计
+            self.statusBar().showMessage(
+                f"nav: requests {self.navigator.requested}, renders {self.navigator.rendered}, "
+                f"skipped {self.navigator.skipped}", 3000)
+        elif re.search(r'^docs\s*$', input_text):  # 会话中的文档
+            names = ', '.join(f'{number} {name}' for number, name in enumerate(self.session_names(), 1))
+            self.statusBar().showMessage(
+                f"docs: {names}; idle cache {self.sessions.idle_bytes() // (1024 * 1024)} MB, "
+                f"spilled {self.sessions.spilled}", 5000)
+        elif re.search(r'^doc\s*:?\s*(.*)$', input_text):  # 切换文档：序号、文件名关键字，省略时切到上一个文档
+            target = re.search(r'^doc\s*:?\s*(.*)$', input_text).group(1).strip()
+            paths = self.sessions.paths()
+            offset = 1 if self.doc_paras_copy['doc'] is not None else 0  # 序号与 docs 列表一致，当前文档占 1 号
+            if not target:
+                matches = paths[:1]
+            elif target.isdigit():
+                matches = paths[int(target) - 1 - offset:int(target) - offset] if int(target) > offset else []
+            else:
+                pattern = build_search_regex(target)
+                matches = [path for path in paths if pattern.search(self.sessions.sessions[path]['doc name'])]
+            if matches:
+                self.switch_document(matches[0])
+            else:
+                self.statusBar().showMessage('no such document in session', 2000)
+        elif re.search(r'^timing\s*$', input_text):  # 打开文件各阶段耗时
+            stages = ', '.join(f'{name} {seconds * 1000:.0f}' for name, seconds in self.open_timings)
+            self.statusBar().showMessage(f"open (ms): {stages}", 5000)
+        else:  # 页码跳转放在所有命令之后，标签恰好与命令同名（TOC、Index 等）时以命令为准
+            label_index = self.label_index(input_text)
+            if label_index is not None:  # 按页码标签跳转（xiv、A-3 等）
+                self.jump_to_page(label_index)
+                self.text_select_and_display()
+            elif re.search(r'(^\d+$)\s*', input_text):  # 页码跳转
+                self.jump_to_page(page_jump(
+                    int(re.search(r'(^\d+$)\s*', input_text).group(1)),
+                    self.doc_paras_copy['ecn'], self.doc_paras_copy['real page'], self.page_labels()
+                ))
+                self.text_select_and_display()
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # PyInstaller 打包后进程池子进程的入口
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    args = [arg for arg in sys.argv[1:] if arg != '--profile-startup']
+    if PROFILE_STARTUP:
+        startup_profile.mark('imports done')
     app = QApplication(sys.argv)
-    pdf_path = sys.argv[1] if len(sys.argv) > 1 else None
+    pdf_path = args[0] if args else None
     viewer = glitchReader(pdf_path)
     viewer.show()
+    if PROFILE_STARTUP:
+        startup_profile.mark('window shown')
+        # 事件循环处理完显示和绘制事件后才会执行该定时器；没有打开文件时到此结束
+        QTimer.singleShot(0, lambda: (startup_profile.mark('first paint'),
+                                      None if pdf_path else startup_profile.report()))
     sys.exit(app.exec_())
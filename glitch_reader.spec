@@ -10,7 +10,7 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=['tkinter', 'unittest', 'pydoc'],  # 用不到的标准库，减小包体积和启动扫描
     noarchive=False,
     optimize=0,
 )
@@ -25,7 +25,7 @@ exe = EXE(
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    upx=False,  # UPX 压缩的 DLL 每次启动都要解压，关闭以加快冷启动
     console=False,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -39,7 +39,7 @@ coll = COLLECT(
     a.binaries,
     a.datas,
     strip=False,
-    upx=True,
+    upx=False,  # UPX 压缩的 DLL 每次启动都要解压，关闭以加快冷启动
     upx_exclude=[],
     name='glitch_reader',
 )
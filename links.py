@@ -0,0 +1,170 @@
+"""
+这个文件是超链接提取相关的函数，只依赖 fitz 和标准库，可以在渲染/扫描子进程中直接导入
+"""
+
+import re
+from contextlib import nullcontext
+
+import fitz
+
+# 超链接提取
+URL_PATTERN = re.compile(r'https?://[^\s\)\]]+')  # 匹配URL的正则表达式
+URL_CONTINUATION = re.compile(r'^[\w\-./?=&%#~+:@;,!*$\']+$')  # 可以作为 URL 续行片段的单词
+URL_BREAK_TAILS = '/-_?&=#%~'  # URL 以这些字符结尾时，行末断开的可能性很大
+URL_BREAK_HEADS = '/?#&=._-'  # 下一行以这些字符开头时，通常是上一行 URL 的延续
+URL_EVIDENCE = '/?=&#%_~'  # 续行片段中含有这些字符时才像 URL 的一部分
+URL_DOTTED = re.compile(r'\w\.\w{2,}')  # 文件名、域名一类带点的片段（e.g、i.e 不算）
+SENTENCE_TAILS = '.,;:!?)]\'"'  # 句末标点，不属于 URL
+PLAIN_TOKEN = re.compile(r'^[a-z0-9\-]+$')  # 不含 URL 字符的小写片段
+
+
+def extract_links(page):
+    """填充 current_links 列表为当前页面超链接信息"""
+
+    current_links = []  # 因为只提前当前页面的链接，所以每次先清空列表
+    words = page.get_text("words")  # 单词及其位置只提取一次，后续步骤共用
+
+    # 1. 提取显式超链接（可点击区域）
+    for link in page.get_links():
+        if link["kind"] == fitz.LINK_URI:
+            # 尝试获取链接文本，这里再写一个提取文本的函数
+            link_text = extract_link_text(words, link["from"])
+            current_links.append({
+                "type": "explicit",
+                "url": link["uri"],
+                "rect": link["from"],
+                "rects": [link["from"]],
+                "text": link_text if link_text else link["uri"]
+            })
+
+    # 2. 提取文本中的URL（非可点击但可能是超链接）
+    text_urls = extract_text_urls(words)  # 包含4条信息的元素
+    current_links.extend(text_urls)
+
+    # 3. 按位置排序链接（从上到下）
+    current_links.sort(key=lambda x: x["rect"].y0)
+
+    return current_links
+
+
+def extract_link_text(words, rect):
+    """提取链接区域内的文本：从整页单词中筛选中心点落在区域内的单词"""
+
+    # 获取链接矩形区域内的所有单词
+    words = [w for w in words if rect.contains(fitz.Point((w[0] + w[2]) / 2, (w[1] + w[3]) / 2))]
+
+    # 按位置排序单词（从左到右，从上到下）
+    words.sort(key=lambda w: (w[1], w[0]))
+
+    # 合并单词形成文本
+    link_text = " ".join(word[4] for word in words)
+
+    # 清理文本（去除多余空格）
+    return re.sub(r'\s+', ' ', link_text).strip()
+
+
+def extract_text_urls(words):
+    """从页面单词列表中一次性找出URL并直接计算其位置，支持跨行断开的URL
+
+    words 为 page.get_text("words") 的结果，不再对每个URL调用 page.search_for 扫描整页。
+    """
+
+    urls = []
+    count = len(words)
+    block_left = {}  # 块号 -> 块内单词的最小左边界
+    for word in words:
+        block_left[word[5]] = min(block_left.get(word[5], word[0]), word[0])
+
+    for i, word in enumerate(words):
+        text = word[4]
+        for match in URL_PATTERN.finditer(text):
+            url = match.group()
+            rect = word_slice_rect(word, match.start(), match.end())
+            rects = [rect]  # 每行一个矩形，跨行时不合并，以免把首行其余文字也框进去
+
+            # URL 恰好在行末结束时，尝试拼接同一块下一行开头的续行片段
+            j = i
+            end = match.end()
+            while end == len(words[j][4]) and j + 1 < count and is_next_line(words[j], words[j + 1], block_left):
+                fragment = url_continuation(url, words[j + 1][4])
+                if not fragment:
+                    break
+                j += 1
+                url += fragment
+                rects.append(word_slice_rect(words[j], 0, len(fragment)))
+                end = len(fragment)
+
+            urls.append({
+                "type": "text",
+                "url": url,
+                "rect": rect,  # 首行矩形，用于排序
+                "rects": rects,
+                "text": url  # 文本就是URL本身
+            })
+
+    return urls
+
+
+def word_slice_rect(word, start: int, end: int):
+    """按字符比例估算单词中 [start, end) 片段的矩形"""
+
+    x0, y0, x1, y1, text = word[:5]
+    if start == 0 and end == len(text):
+        return fitz.Rect(x0, y0, x1, y1)
+    char_width = (x1 - x0) / max(len(text), 1)
+    return fitz.Rect(x0 + start * char_width, y0, x0 + end * char_width, y1)
+
+
+def is_next_line(word, next_word, block_left: dict):
+    """next_word 是否是 word 所在行的下一行行首：同一块、行号加一、竖直方向相邻、靠近块的左边界"""
+
+    if next_word[5] != word[5] or next_word[6] != word[6] + 1 or next_word[7] != 0:
+        return False
+    height = word[3] - word[1]
+    if next_word[1] - word[3] > height:  # 中间隔了空行，多半是另一段
+        return False
+    return next_word[0] - block_left[word[5]] <= height * 2
+
+
+def url_continuation(url: str, next_word: str):
+    """下一行开头的单词是行末 URL 的续行时，返回应拼接的片段（去掉句末标点），否则返回空字符串
+
+    大写开头的单词不拼接；片段中没有 URL 字符时，只有在 URL 以连字符等断开（不是以 / 结尾）、
+    片段是不带句末标点的小写单词时才拼接。
+    """
+
+    if next_word.startswith('http') or not URL_CONTINUATION.match(next_word) or next_word[0].isupper():
+        return ''
+    fragment = next_word.rstrip(SENTENCE_TAILS)
+    if not fragment:
+        return ''
+    if next_word[0] in URL_BREAK_HEADS or any(char in fragment for char in URL_EVIDENCE) \
+            or URL_DOTTED.search(fragment):
+        return fragment
+    if (url[-1] in URL_BREAK_TAILS and url[-1] != '/' and fragment == next_word
+            and PLAIN_TOKEN.match(fragment)):
+        return fragment
+    return ''
+
+
+def scan_links(file_path: str, start: int, stop: int, lock=None):
+    """扫描 [start, stop) 范围内各页的超链接，返回可 pickle 的 (页码下标, 类型, url, 各行矩形元组, 文本) 列表
+
+    在线程中调用时传入 fitz_lock，每页持锁一次；在子进程中调用时无需加锁。
+    """
+
+    results = []
+    lock = lock if lock is not None else nullcontext()
+    with lock:
+        doc = fitz.open(file_path)
+    try:
+        for page_index in range(start, stop):
+            with lock:
+                links = extract_links(doc[page_index])
+            for link in links:
+                results.append((page_index, link["type"], link["url"], tuple(tuple(rect) for rect in link["rects"]),
+                                link["text"]))
+    finally:
+        with lock:
+            doc.close()
+    return results
@@ -2,7 +2,23 @@
 这个文件装填一些需要的类
 """
 
+import bisect
+import json
+import multiprocessing
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import fitz
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+fitz_lock = threading.RLock()  # MuPDF 不支持多线程并发调用，所有渲染都需持有该锁
+# 进程池一律 spawn：fork 会连同其他线程持有的 fitz_lock 一起复制多线程的 Qt 进程
+process_context = multiprocessing.get_context('spawn')
 
 
 # 信号节点类，实例包含参数：信号名称，信号值；以及一个添加子级信号的方法
@@ -56,18 +72,969 @@ class SignalNode:
                     signal.check_close_signal()
         else:
             for signal in self.mutual_signals:
-                signal.check_close_signal()
+                if signal.value:  # 只进入开启的分支，互斥层超过两个信号时避免相互递归
+                    signal.check_close_signal()
+
+
+# 渲染页面缓存类，按字节预算做 LRU 淘汰；键由调用方决定（文档、页码、缩放因子、渲染选项）
+class PageCache:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes  # 字节预算
+        self.current_bytes = 0  # 当前占用字节数
+        self.entries = OrderedDict()  # key -> (value, nbytes)，越靠后越新
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):  # 命中时移到队尾并返回缓存值，未命中返回 None
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, nbytes: int):  # 加入缓存，超出预算时淘汰最久未使用的条目
+        if key in self.entries:
+            self.current_bytes -= self.entries.pop(key)[1]
+        if nbytes > self.max_bytes:  # 单个条目超过整个预算则不缓存
+            return
+        self.entries[key] = (value, nbytes)
+        self.current_bytes += nbytes
+        self._evict()
+
+    def set_budget(self, max_bytes: int):  # 修改字节预算
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def clear(self):
+        self.entries.clear()
+        self.current_bytes = 0
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self.entries:
+            _, (_, nbytes) = self.entries.popitem(last=False)
+            self.current_bytes -= nbytes
+
+
+# 显示列表缓存类：页面首次显示时把内容流解析为 fitz.DisplayList，之后任意缩放、裁剪只需光栅化
+class DisplayListCache:
+    def __init__(self, max_pages: int = 32):
+        self.max_pages = max_pages  # 最多保留的页面数
+        self.entries = OrderedDict()  # 页码下标 -> (Page, DisplayList)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, doc, page_index: int):  # 返回 (Page, DisplayList)，未缓存时加载页面并生成显示列表
+        entry = self.entries.get(page_index)
+        if entry is not None:
+            self.entries.move_to_end(page_index)
+            return entry
+        with fitz_lock:
+            page = doc.load_page(page_index)
+            entry = (page, page.get_displaylist())
+        self.entries[page_index] = entry
+        while len(self.entries) > self.max_pages:
+            self.entries.popitem(last=False)
+        return entry
+
+    def put(self, page_index: int, entry: tuple):  # 放入在其他线程中生成的 (Page, DisplayList)
+        self.entries[page_index] = entry
+        while len(self.entries) > self.max_pages:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+# 帧缓冲类：image 直接引用 owner（MuPDF Pixmap 或共享内存块）的像素内存（零复制），
+# 因此必须持有 owner 直到 image 上传完毕
+class FrameBuffer:
+    def __init__(self, owner, image, nbytes: int, copied: int = 0, on_release=None):
+        self.owner = owner  # 像素内存的所有者，生命周期必须长于 image
+        self.image = image  # QImage
+        self.nbytes = nbytes  # 像素内存大小
+        self.copied = copied  # 构建 image 时复制的字节数
+        self.on_release = on_release  # 释放 owner 时的回调，如关闭并删除共享内存块
+
+    def release(self):  # 先释放 image 再释放 owner
+        self.image = None
+        if self.owner is not None and self.on_release is not None:
+            self.on_release(self.owner)
+        self.owner = None
+
+
+# 帧统计类：记录每帧从 MuPDF 到 QPixmap 实际复制的字节数，以及零复制省下的字节数
+class FrameStats:
+    def __init__(self):
+        self.frames = 0
+        self.bytes_copied = 0
+        self.bytes_avoided = 0
+        self.last_frame_copied = 0
+
+    def record(self, copied: int, avoided: int):
+        self.frames += 1
+        self.bytes_copied += copied
+        self.bytes_avoided += avoided
+        self.last_frame_copied = copied
+
+
+# 线程渲染引擎：单个工作线程持有独立的文件句柄和显示列表缓存，与界面线程通过 fitz_lock 串行使用 MuPDF
+class ThreadRenderEngine:
+    def __init__(self, render_func):
+        self.render_func = render_func  # render_func(display_list, scale_factor, clip) -> FrameBuffer
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='render')
+        self.file_path = ''
+        self._doc = None  # 仅在工作线程中访问
+        self._doc_path = ''
+        self._display_lists = DisplayListCache()  # 工作线程自己的显示列表缓存
+
+    def open(self, file_path: str):
+        self.file_path = file_path
+
+    def submit(self, page_index: int, scale_factor: float, clip=None):  # 返回结果为 FrameBuffer 的 Future
+        return self.executor.submit(self._render, self.file_path, page_index, scale_factor, clip)
+
+    def to_frame(self, result):
+        return result
+
+    def shutdown(self):
+        self.executor.submit(self._close_doc)
+        self.executor.shutdown(wait=False)
+
+    def _render(self, file_path, page_index, scale_factor, clip):  # 运行在工作线程
+        with fitz_lock:
+            if self._doc_path != file_path:
+                self._close_doc()
+                self._doc = fitz.open(file_path)
+                self._doc_path = file_path
+            _, display_list = self._display_lists.get(self._doc, page_index)
+            return self.render_func(display_list, scale_factor, clip)
+
+    def _close_doc(self):
+        with fitz_lock:
+            self._display_lists.clear()
+            if self._doc is not None:
+                self._doc.close()
+            self._doc = None
+            self._doc_path = ''
+
+
+# 进程渲染引擎：每个工作进程各自 fitz.open 当前文件，像素写入共享内存块，只有块名经过 pickle；
+# spawn 出的工作进程启动时要重新导入主模块（包括 PyQt5），所以进程池只建一次，换文件不重建
+class ProcessRenderEngine:
+    def __init__(self, workers: int, frame_func):
+        self.workers = workers  # 工作进程数
+        self.frame_func = frame_func  # frame_func(块名, 宽, 高, 行跨度) -> FrameBuffer
+        self.executor = None
+        self.file_path = ''
+
+    def open(self, file_path: str):  # 换文件时只换路径，工作进程在下一个任务中自行重新打开
+        if self.executor is None:
+            from concurrent.futures import ProcessPoolExecutor  # 进程池相关模块较重，用到时才导入
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=process_context)
+        self.file_path = file_path
+
+    def submit(self, page_index: int, scale_factor: float, clip=None):  # 返回结果为 (块名, 宽, 高, 行跨度) 的 Future
+        import render_worker  # 只在多进程渲染模式下导入
+        clip = tuple(clip) if clip is not None else None
+        return self.executor.submit(render_worker.render_to_shared_memory, self.file_path, page_index, scale_factor,
+                                    clip)
+
+    def to_frame(self, result):  # 在界面线程中把共享内存块包装为 FrameBuffer
+        return self.frame_func(*result)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+        self.file_path = ''
+
+
+# 预读调度类：把相邻页面交给渲染引擎（线程或进程），结果通过 page_ready 信号回到界面线程
+class PrefetchScheduler(QObject):
+    page_ready = pyqtSignal(object, int, object, object)  # (缓存键, 任务代数, 产生结果的引擎, 引擎返回的结果)
+
+    def __init__(self, engine):
+        super().__init__()
+        self.engine = engine
+        self.file_path = ''
+        self.pending = {}  # 缓存键 -> Future
+        self.taken = set()  # 已被 take 直接取走结果的缓存键，其 page_ready 信号需忽略
+        self.generation = 0  # 每次切换文件或取消全部任务时自增，旧任务的结果直接作废
+
+    def open(self, file_path: str):  # 切换预读的目标文件
+        self.cancel_all()
+        self.file_path = file_path
+        self.engine.open(file_path)
+
+    def set_engine(self, engine):  # 切换渲染引擎
+        self.cancel_all()
+        self.engine.shutdown()
+        self.engine = engine
+        if self.file_path:
+            self.engine.open(self.file_path)
+
+    def schedule(self, jobs: list):  # jobs: [(缓存键, 页码下标, 缩放因子)]，越靠前越优先
+        wanted = {key for key, _, _ in jobs}
+        for key in [key for key in self.pending if key not in wanted]:  # 取消已离开预读窗口的任务
+            self.pending.pop(key).cancel()
+        for key, page_index, scale_factor in jobs:
+            if key not in self.pending:
+                future = self.engine.submit(page_index, scale_factor)
+                future.add_done_callback(lambda f, k=key, g=self.generation, e=self.engine: self._done(k, g, e, f))
+                self.pending[key] = future
+
+    def take(self, key):  # 界面线程需要的页面正在预读时，等待其结果而不是重新渲染
+        future = self.pending.pop(key, None)
+        if future is None or future.cancel():  # 尚未开始的任务直接取消，由界面线程自行渲染
+            return None
+        if future.exception() is not None:
+            return None
+        self.taken.add(key)
+        return self.engine.to_frame(future.result())
+
+    def accept(self, key, generation: int, engine, result):  # 处理 page_ready 信号，返回可用的 FrameBuffer 或 None
+        if key in self.taken:
+            self.taken.discard(key)
+            return None
+        frame = engine.to_frame(result)  # 切换引擎前提交的任务，结果格式属于原来的引擎
+        if generation != self.generation:  # 过期结果也要释放其像素内存
+            frame.release()
+            return None
+        self.pending.pop(key, None)
+        return frame
+
+    def cancel_all(self):
+        self.generation += 1
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+
+    def shutdown(self):
+        self.cancel_all()
+        self.engine.shutdown()
+
+    def _done(self, key, generation: int, engine, future):  # 运行在工作线程或进程池的管理线程
+        if not future.cancelled() and future.exception() is None:
+            self.page_ready.emit(key, generation, engine, future.result())
+
+
+# 全文档超链接目录类：由后台扫描逐块填充，扫描未完成时已有的结果也可以直接使用
+class LinkCatalogue:
+    def __init__(self):
+        self.entries = []  # [(页码下标, 类型, url, 各行矩形元组, 文本)]，按页码、首行纵坐标排序
+        self.total_pages = 0
+        self.pages_scanned = 0
+
+    @property
+    def complete(self):
+        return self.pages_scanned >= self.total_pages
+
+    def add_chunk(self, results: list, pages: int):  # 各块完成顺序不定，合并后重新排序
+        self.entries.extend(results)
+        self.entries.sort(key=lambda entry: (entry[0], entry[3][0][1]))
+        self.pages_scanned += pages
+
+
+# 超链接扫描类：打开文件后在后台遍历全部页面，大文件用多进程分块扫描，每完成一块发出 chunk_ready 信号
+class LinkScanner(QObject):
+    chunk_ready = pyqtSignal(int, object, int)  # (任务代数, 扫描结果, 该块页数)
+
+    def __init__(self, chunk_pages: int = 50, process_threshold: int = 300):
+        super().__init__()
+        self.chunk_pages = chunk_pages  # 每块页数
+        self.process_threshold = process_threshold  # 页数达到该值时改用多进程
+        self.executor = None
+        self.generation = 0
+
+    def start(self, file_path: str, page_count: int):
+        import links  # 超链接提取在打开文件的最后阶段才需要
+        self.cancel()
+        if page_count >= self.process_threshold:
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) - 1),
+                                                mp_context=process_context)
+            lock = None
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='links')
+            lock = fitz_lock
+        for start in range(0, page_count, self.chunk_pages):
+            stop = min(start + self.chunk_pages, page_count)
+            future = self.executor.submit(links.scan_links, file_path, start, stop, lock)
+            future.add_done_callback(lambda f, g=self.generation, n=stop - start: self._done(g, n, f))
+
+    def cancel(self):
+        self.generation += 1
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+
+    def _done(self, generation: int, pages: int, future):  # 出错的块按无链接计入进度
+        if future.cancelled():
+            return
+        results = future.result() if future.exception() is None else []
+        self.chunk_ready.emit(generation, results, pages)
+
+
+# 全文索引构建类：在后台提取全部页面单词并写出索引文件，大文件用子进程构建，完成后发出 finished 信号
+class TextIndexBuilder(QObject):
+    finished = pyqtSignal(int, str)  # (任务代数, 索引路径，失败时为空字符串)
+
+    def __init__(self, process_threshold: int = 300):
+        super().__init__()
+        self.process_threshold = process_threshold  # 页数达到该值时改用子进程
+        self.executor = None
+        self.generation = 0
+
+    def start(self, file_path: str, index_path: str, page_count: int):
+        import text_index  # 全文索引在打开文件的最后阶段才需要
+        self.cancel()
+        if page_count >= self.process_threshold:
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(max_workers=1, mp_context=process_context)
+            lock = None
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='index')
+            lock = fitz_lock
+        future = self.executor.submit(text_index.build_index, file_path, index_path, lock)
+        future.add_done_callback(lambda f, g=self.generation: self._done(g, f))
+
+    def cancel(self):
+        self.generation += 1
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+
+    def _done(self, generation: int, future):
+        if future.cancelled():
+            return
+        self.finished.emit(generation, future.result() if future.exception() is None else '')
+
+
+# 流式扫描类：在工作线程中逐页正则匹配，命中一页就发出一次 hit_found，可随时取消
+class TextScanner(QObject):
+    hit_found = pyqtSignal(int, int, object)  # (任务代数, 页码下标, 矩形元组列表)
+    finished = pyqtSignal(int, int)  # (任务代数, 已扫描页数)
+
+    def __init__(self):
+        super().__init__()
+        self.cancel_event = threading.Event()
+        self.generation = 0
+        self.running = False
+
+    def start(self, file_path: str, pattern, current_page_index: int):
+        self.cancel()
+        self.cancel_event = threading.Event()
+        self.running = True
+        threading.Thread(target=self._run, daemon=True, name='scan',
+                         args=(self.generation, file_path, pattern, current_page_index, self.cancel_event)).start()
+
+    def cancel(self):
+        self.generation += 1
+        self.running = False
+        self.cancel_event.set()
+
+    def _run(self, generation, file_path, pattern, current_page_index, cancel):
+        import text_index
+        hits = 0
+        try:
+            for page_index, rects in text_index.scan_pages(file_path, pattern, current_page_index, cancel, fitz_lock):
+                hits += 1
+                self.hit_found.emit(generation, page_index, rects)
+        finally:
+            if not cancel.is_set():
+                self.finished.emit(generation, hits)
+
+
+# 书签搜索索引类：标题三元组 -> 书签序号 的倒排表，增删书签时增量更新，查询结果按关键字缓存
+class BookmarkIndex:
+    def __init__(self):
+        self.items = {}  # 序号 -> 书签 [标题, 页码]
+        self.item_ids = {}  # 标题 -> 序号（标题在书签中唯一）
+        self.trigrams = {}  # 三元组 -> {序号}
+        self.next_id = 0
+        self.results = {}  # 查询关键字 -> 搜索结果，书签变动时清空
+
+    @staticmethod
+    def title_trigrams(title: str):
+        title = title.lower()
+        return {title[i:i + 3] for i in range(len(title) - 2)}
+
+    def add(self, bookmark: list):
+        self.items[self.next_id] = bookmark
+        self.item_ids[bookmark[0]] = self.next_id
+        for trigram in self.title_trigrams(bookmark[0]):
+            self.trigrams.setdefault(trigram, set()).add(self.next_id)
+        self.next_id += 1
+        self.results.clear()
+
+    def remove(self, bookmark: list):
+        item_id = self.item_ids.pop(bookmark[0], None)
+        if item_id is None:
+            return
+        del self.items[item_id]
+        for trigram in self.title_trigrams(bookmark[0]):
+            self.trigrams[trigram].discard(item_id)
+            if not self.trigrams[trigram]:
+                del self.trigrams[trigram]
+        self.results.clear()
+
+    def candidates(self, key_words: str):  # 每个不短于三个字符的关键字的全部三元组都必须出现在标题中
+        from text_index import tokenize  # 第一次搜索书签时才导入
+        ids = None
+        for keyword in tokenize(key_words):
+            for trigram in self.title_trigrams(keyword):
+                ids = set(self.trigrams.get(trigram, ())) if ids is None else ids & self.trigrams.get(trigram, set())
+                if not ids:
+                    return set()
+        return set(self.items) if ids is None else ids
+
+    def search(self, key_words: str, pattern):
+        """返回标题匹配 pattern 的书签，顺序与书签列表相同；同一关键字只计算一次"""
+
+        if key_words not in self.results:
+            hits = [item_id for item_id in self.candidates(key_words) if pattern.search(self.items[item_id][0])]
+            hits.sort(key=lambda item_id: (self.items[item_id][1], item_id))  # 书签列表按页码稳定排序
+            self.results[key_words] = [self.items[item_id] for item_id in hits]
+        return self.results[key_words]
+
+
+# 书签存储类：书签 [标题, 页码] 按页码有序存放，二分插入，标题哈希查重，按页码分组，并维护搜索索引
+class BookmarkStore:
+    def __init__(self, bookmarks=()):
+        self.entries = []  # 按页码稳定排序的书签
+        self.pages = []  # 与 entries 对应的页码，用于二分查找
+        self.titles = {}  # 标题 -> 书签
+        self.by_page = {}  # 页码 -> [书签]
+        self.index = BookmarkIndex()
+        for bookmark in bookmarks:
+            self.add(list(bookmark))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        return self.entries[i]
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __contains__(self, title):
+        return title in self.titles
+
+    def add(self, bookmark: list):
+        """加入书签，标题已存在时返回 False"""
+
+        if bookmark[0] in self.titles:
+            return False
+        position = bisect.bisect_right(self.pages, bookmark[1])  # 同页书签保持加入顺序
+        self.entries.insert(position, bookmark)
+        self.pages.insert(position, bookmark[1])
+        self.titles[bookmark[0]] = bookmark
+        self.by_page.setdefault(bookmark[1], []).append(bookmark)
+        self.index.add(bookmark)
+        return True
+
+    def remove(self, bookmark: list):
+        position = bisect.bisect_left(self.pages, bookmark[1])
+        while self.entries[position] is not bookmark:
+            position += 1
+        del self.entries[position]
+        del self.pages[position]
+        del self.titles[bookmark[0]]
+        self.by_page[bookmark[1]].remove(bookmark)
+        if not self.by_page[bookmark[1]]:
+            del self.by_page[bookmark[1]]
+        self.index.remove(bookmark)
+
+    def on_page(self, page: int):
+        """某页（从 1 开始）上的全部书签"""
+
+        return self.by_page.get(page, [])
+
+    def search(self, key_words: str, pattern):
+        return self.index.search(key_words, pattern)
+
+    def to_list(self):
+        """转换为保存文件中的 [[标题, 页码], ...] 格式"""
+
+        return [bookmark[:] for bookmark in self.entries]
+
+
+# 书签显示视图：不复制书签，取某一项时才按页码纠错值（或页码标签）换算页码
+class BookmarkView:
+    def __init__(self, bookmarks, error_correct: int, real_page: bool, labels=None):
+        self.bookmarks = bookmarks
+        self.offset = error_correct if real_page else 0
+        self.labels = labels if real_page else None
+
+    def __len__(self):
+        return len(self.bookmarks)
+
+    def __getitem__(self, i):
+        title, page = self.bookmarks[i]
+        if self.labels is not None:
+            return [title, self.labels.label(page - 1)]
+        return [title, page - self.offset]
+
+
+# 页码标签表：打开文件时按 /PageLabels 规则算出每一页的标签，页码下标与标签双向查表
+class PageLabelMap:
+    ROMAN = ((1000, 'm'), (900, 'cm'), (500, 'd'), (400, 'cd'), (100, 'c'), (90, 'xc'),
+             (50, 'l'), (40, 'xl'), (10, 'x'), (9, 'ix'), (5, 'v'), (4, 'iv'), (1, 'i'))
+
+    def __init__(self, rules: list, page_count: int):  # rules: doc.get_page_labels()
+        self.rules = sorted(rules, key=lambda rule: rule['startpage'])
+        self.labels = [str(index + 1) for index in range(page_count)]  # 规则未覆盖的页面用 PDF 页码
+        for position, rule in enumerate(self.rules):
+            start = rule['startpage']
+            end = self.rules[position + 1]['startpage'] if position + 1 < len(self.rules) else page_count
+            first = rule.get('firstpagenum', 1)
+            for index in range(start, min(end, page_count)):
+                self.labels[index] = rule.get('prefix', '') + self.format_number(rule.get('style', ''),
+                                                                                 first + index - start)
+        self.indexes = {}  # 标签 -> 页码下标，重复的标签取第一次出现的页
+        for index, label in enumerate(self.labels):
+            self.indexes.setdefault(label, index)
+            self.indexes.setdefault(label.casefold(), index)
+
+    @classmethod
+    def format_number(cls, style: str, number: int):
+        if style == 'D':
+            return str(number)
+        if style in ('r', 'R'):
+            text = ''
+            for value, numeral in cls.ROMAN:
+                count, number = divmod(number, value)
+                text += numeral * count
+            return text.upper() if style == 'R' else text
+        if style in ('a', 'A'):  # A..Z, AA..ZZ, AAA..
+            letter = chr(ord(style) + (number - 1) % 26)
+            return letter * ((number - 1) // 26 + 1)
+        return ''  # 无编号样式，只有前缀
+
+    def __len__(self):
+        return len(self.labels)
+
+    def label(self, page_index: int):
+        return self.labels[page_index] if 0 <= page_index < len(self.labels) else str(page_index + 1)
+
+    def index_of(self, label: str):
+        """标签对应的页码下标，找不到返回 None"""
+
+        label = label.strip()
+        if not label:
+            return None
+        index = self.indexes.get(label)
+        return index if index is not None else self.indexes.get(label.casefold())
+
+
+# 自动保存日志类：书签、目录页、页码纠错值、视图的每次改动追加写入日志文件，
+# 由后台线程成批写入并 fsync；压缩时把完整快照原子替换到保存文件，再清空日志
+class SaveJournal:
+    def __init__(self, snapshot_writer):
+        self.snapshot_writer = snapshot_writer  # (文档键, 快照) -> None，需保证原子替换
+        self.queue = None
+        self.thread = None
+        self.pending = 0  # 上次压缩以来的日志条数
+
+    def open(self, key: str, journal_path: str):
+        self.close()
+        self.queue = queue.Queue()
+        self.pending = 0
+        self.thread = threading.Thread(target=self._run, args=(self.queue, key, journal_path),
+                                       daemon=True, name='journal')
+        self.thread.start()
+
+    def record(self, entry: dict):
+        """追加一条改动，不等待写盘"""
+
+        if self.queue is not None:
+            self.pending += 1
+            self.queue.put(('record', entry))
+
+    def compact(self, snapshot: dict):
+        """写出完整快照并清空日志，不等待写盘"""
+
+        if self.queue is not None:
+            self.pending = 0
+            self.queue.put(('compact', snapshot))
+
+    def close(self, wait: bool = True):
+        """写完队列中的全部改动后结束写线程；wait 为 False 时不等待，返回写线程供调用方稍后 join"""
+
+        thread = self.thread
+        if thread is not None:
+            self.queue.put(('close', None))
+            if wait:
+                thread.join()
+        self.queue = None
+        self.thread = None
+        return thread
+
+    def _run(self, tasks, key, journal_path):
+        closing = False
+        with open(journal_path, 'a', encoding='utf-8') as file:
+            while not closing:
+                batch = [tasks.get()]
+                while True:  # 把已排队的改动合成一批，只 fsync 一次
+                    try:
+                        batch.append(tasks.get_nowait())
+                    except queue.Empty:
+                        break
+                dirty = False
+                for kind, payload in batch:
+                    if kind == 'record':
+                        file.write(json.dumps(payload, ensure_ascii=False) + '\n')
+                        dirty = True
+                    elif kind == 'compact':  # 快照已包含之前的全部改动，替换成功后日志才清空
+                        self.snapshot_writer(key, payload)
+                        file.seek(0)
+                        file.truncate()
+                        dirty = True
+                    else:
+                        closing = True
+                if dirty:
+                    file.flush()
+                    os.fsync(file.fileno())
+
+
+# 元数据存储类：所有文档的保存数据放在同一个 SQLite 文件中，以文件局部内容哈希为主键，
+# 改名、移动文件不会丢数据，同名的不同文件也不会互相覆盖；可被日志写线程调用，内部加锁
+class MetadataStore:
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS documents (
+            hash TEXT PRIMARY KEY,
+            name TEXT,
+            path TEXT,
+            toc_page INTEGER,
+            ecn INTEGER NOT NULL DEFAULT 0,
+            tt_view INTEGER NOT NULL DEFAULT 0,
+            bt_view INTEGER NOT NULL DEFAULT 0,
+            last_page INTEGER,
+            last_scale REAL,
+            scroll_x INTEGER,
+            scroll_y INTEGER,
+            raw_toc_page INTEGER,
+            opened_at REAL
+        )""",
+        """CREATE TABLE IF NOT EXISTS bookmarks (
+            hash TEXT NOT NULL,
+            title TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            PRIMARY KEY (hash, title)
+        )""",
+        "CREATE INDEX IF NOT EXISTS bookmarks_page ON bookmarks (hash, page)",
+    )
+    ADDED_COLUMNS = (('last_scale', 'REAL'), ('scroll_x', 'INTEGER'), ('scroll_y', 'INTEGER'),
+                     ('raw_toc_page', 'INTEGER'))  # 旧版数据库缺少的列
+
+    def __init__(self, db_path: str):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+            columns = {row[1] for row in self.connection.execute('PRAGMA table_info(documents)')}
+            for column, column_type in self.ADDED_COLUMNS:
+                if column not in columns:
+                    self.connection.execute(f'ALTER TABLE documents ADD COLUMN {column} {column_type}')
+
+    def touch(self, key: str, name: str, path: str):
+        """登记一次打开：记录文件名、路径和时间，返回该文档是否已有保存数据"""
+
+        with self.lock, self.connection:
+            exists = self.connection.execute('SELECT 1 FROM documents WHERE hash = ?', (key,)).fetchone() is not None
+            self.connection.execute(
+                'INSERT INTO documents (hash, name, path, opened_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(hash) DO UPDATE SET name = excluded.name, path = excluded.path, '
+                'opened_at = excluded.opened_at', (key, name, path, time.time()))
+        return exists
+
+    def load(self, key: str):
+        """读出与保存数据相同格式的字典，没有记录时返回 None"""
+
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT toc_page, ecn, tt_view, bt_view, last_page, last_scale, scroll_x, scroll_y, raw_toc_page '
+                'FROM documents WHERE hash = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            bookmarks = self.connection.execute(
+                'SELECT title, page FROM bookmarks WHERE hash = ? ORDER BY page, rowid', (key,)).fetchall()
+        return {
+            "toc page": row[0],
+            "bookmarks": [list(bookmark) for bookmark in bookmarks],
+            "tt view": bool(row[2]),
+            "bt view": bool(row[3]),
+            "ecn": row[1],
+            "last page": row[4],
+            "last scale": row[5],
+            "last scroll": None if row[6] is None else [row[6], row[7]],
+            "raw toc page": row[8],
+        }
+
+    def save(self, key: str, data: dict):
+        """在一个事务中写入完整快照，作为 SaveJournal 的快照写入函数"""
+
+        with self.lock, self.connection:
+            scroll_x, scroll_y = data['last scroll'] if data.get('last scroll') else (None, None)
+            self.connection.execute(
+                'INSERT INTO documents (hash, toc_page, ecn, tt_view, bt_view, last_page, last_scale, scroll_x, scroll_y, '
+                'raw_toc_page) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(hash) DO UPDATE SET toc_page = excluded.toc_page, ecn = excluded.ecn, '
+                'tt_view = excluded.tt_view, bt_view = excluded.bt_view, last_page = excluded.last_page, '
+                'last_scale = excluded.last_scale, scroll_x = excluded.scroll_x, scroll_y = excluded.scroll_y, '
+                'raw_toc_page = excluded.raw_toc_page',
+                (key, data['toc page'], data['ecn'], int(data['tt view']), int(data['bt view']),
+                 data.get('last page'), data.get('last scale'), scroll_x, scroll_y, data.get('raw toc page')))
+            self.connection.execute('DELETE FROM bookmarks WHERE hash = ?', (key,))
+            self.connection.executemany('INSERT INTO bookmarks (hash, title, page) VALUES (?, ?, ?)',
+                                        [(key, title, page) for title, page in data['bookmarks']])
+
+    def rekey(self, old_key: str, new_key: str):
+        """文件内容改变（如追加了页面）后，把保存数据转到新的内容哈希下"""
+
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM bookmarks WHERE hash = ?', (new_key,))
+            self.connection.execute('DELETE FROM documents WHERE hash = ?', (new_key,))
+            self.connection.execute('UPDATE documents SET hash = ? WHERE hash = ?', (new_key, old_key))
+            self.connection.execute('UPDATE bookmarks SET hash = ? WHERE hash = ?', (new_key, old_key))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+# 分阶段加载类：在工作线程中依次执行各阶段，每完成一个阶段就发出结果和耗时；
+# 各阶段通过共享的 context 字典传递中间结果，开始新任务后旧任务在阶段之间停止
+class StagedLoader(QObject):
+    stage_done = pyqtSignal(int, str, object, float)  # (任务代数, 阶段名, 结果, 耗时秒)
+    stage_failed = pyqtSignal(int, str, str)  # (任务代数, 阶段名, 错误信息)
+
+    def __init__(self):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='open')
+        self.generation = 0
+
+    def start(self, stages: list):  # stages: [(阶段名, stage(context) -> 结果)]
+        self.generation += 1
+        self.executor.submit(self._run, self.generation, stages)
+        return self.generation
+
+    def cancel(self):
+        self.generation += 1
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, generation: int, stages: list):
+        context = {}
+        for name, stage in stages:
+            if generation != self.generation:
+                return
+            start = time.perf_counter()
+            try:
+                result = stage(context)
+            except Exception as error:
+                self.stage_failed.emit(generation, name, f'{type(error).__name__}: {error}')
+                return
+            self.stage_done.emit(generation, name, result, time.perf_counter() - start)
+
+
+# 文档会话池：切换走的文档连同它的文档参数（打开的句柄、渲染缓存、阅读位置）按最近使用顺序保留，
+# 文档数超过上限时关闭最久未用的文档；空闲文档的页面缓存总量超过预算时，从最久未用的文档开始清空缓存
+class DocumentPool:
+    def __init__(self, max_documents: int = 4, max_idle_bytes: int = 256 * 1024 * 1024):
+        self.max_documents = max_documents  # 同时打开的文档数上限（包括正在阅读的文档）
+        self.max_idle_bytes = max_idle_bytes  # 空闲文档页面缓存的总字节预算
+        self.sessions = OrderedDict()  # 文件路径 -> 文档参数，越靠后越新
+        self.spilled = 0  # 清空过缓存的次数
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, file_path):
+        return file_path in self.sessions
+
+    def paths(self):
+        """空闲文档的文件路径，最近使用的在前"""
+
+        return list(reversed(self.sessions))
+
+    def park(self, file_path: str, paras: dict):
+        """放入切换走的文档，返回被替换或因超出上限而移出的文档参数，由调用方关闭"""
+
+        replaced = self.sessions.pop(file_path, None)
+        evicted = [replaced] if replaced is not None and replaced is not paras else []
+        self.sessions[file_path] = paras
+        while len(self.sessions) > max(self.max_documents - 1, 0):
+            evicted.append(self.sessions.popitem(last=False)[1])
+        self.spill()
+        return evicted
+
+    def take(self, file_path: str):
+        """取出要切换回来的文档参数，不在池中时返回 None"""
+
+        return self.sessions.pop(file_path, None)
+
+    def drain(self):
+        """取出全部文档参数（退出时关闭）"""
+
+        sessions = list(self.sessions.values())
+        self.sessions.clear()
+        return sessions
+
+    def idle_bytes(self):
+        return sum(paras['page cache'].current_bytes for paras in self.sessions.values())
+
+    def spill(self):
+        total = self.idle_bytes()
+        for paras in self.sessions.values():  # 从最久未用的文档开始
+            if total <= self.max_idle_bytes:
+                break
+            total -= paras['page cache'].current_bytes
+            paras['page cache'].clear()
+            paras['display lists'].clear()
+            self.spilled += 1
+
+
+# 大纲树类：打开文件时读取一次 get_toc，建立父子索引；只展开用户打开的层级，
+# 标题搜索在上一次结果上增量过滤，按页码二分查找所在章节
+class OutlineTree:
+    def __init__(self, toc: list):  # toc: doc.get_toc(simple=True)，[[层级, 标题, 页码（从 1 开始）], ...]
+        self.levels = [item[0] for item in toc]
+        self.titles = [item[1] for item in toc]
+        self.pages = [item[2] - 1 if item[2] > 0 else -1 for item in toc]  # 页码下标，无目标页时为 -1
+        self.parents = []  # 父节点序号，顶层为 -1
+        self.children = [[] for _ in toc]  # 子节点序号
+        self.roots = []
+        stack = []  # 当前路径上的节点序号
+        for node, level in enumerate(self.levels):
+            while stack and self.levels[stack[-1]] >= level:
+                stack.pop()
+            parent = stack[-1] if stack else -1
+            self.parents.append(parent)
+            (self.children[parent] if parent >= 0 else self.roots).append(node)
+            stack.append(node)
+        self.expanded = set()  # 已展开的节点
+        self._rows = None  # 可见行缓存，展开或折叠时失效
+        starts = sorted((page, node) for node, page in enumerate(self.pages) if page >= 0)
+        self.start_pages = [page for page, _ in starts]  # 按页码排序的章节起始页
+        self.start_nodes = [node for _, node in starts]
+        self.last_query = None  # 上一次搜索的关键字
+        self.last_hits = []  # 上一次搜索的结果
+
+    def __len__(self):
+        return len(self.titles)
+
+    def rows(self):
+        """当前可见的节点序号：顶层节点及已展开节点的子节点，按大纲顺序排列"""
+
+        if self._rows is None:
+            rows = []
+            stack = list(reversed(self.roots))
+            while stack:
+                node = stack.pop()
+                rows.append(node)
+                if node in self.expanded:
+                    stack.extend(reversed(self.children[node]))
+            self._rows = rows
+        return self._rows
+
+    def expand(self, node: int):
+        if self.children[node] and node not in self.expanded:
+            self.expanded.add(node)
+            self._rows = None
+
+    def collapse(self, node: int):
+        if node in self.expanded:
+            self.expanded.discard(node)
+            self._rows = None
+
+    def reveal(self, node: int):
+        """展开 node 的全部祖先，使其可见"""
+
+        parent = self.parents[node]
+        while parent >= 0:
+            self.expand(parent)
+            parent = self.parents[parent]
+
+    def section_at(self, page_index: int):
+        """页面所在的最深一级章节序号，第一个章节之前返回 -1"""
+
+        position = bisect.bisect_right(self.start_pages, page_index) - 1
+        return self.start_nodes[position] if position >= 0 else -1
+
+    def search(self, key_words: str, pattern):
+        """标题搜索；关键字在上一次的基础上追加时，只在上一次的结果中过滤"""
+
+        if self.last_query is not None and key_words.startswith(self.last_query):
+            candidates = self.last_hits
+        else:
+            candidates = range(len(self.titles))
+        self.last_hits = [node for node in candidates if pattern.search(self.titles[node])]
+        self.last_query = key_words
+        return self.last_hits
+
+
+# 导航调度类：合并连续的翻页/缩放请求，计时器到期后只按最终状态渲染一次
+class NavigationScheduler(QObject):
+    def __init__(self, render_callback, parent=None):
+        super().__init__(parent)
+        self.render_callback = render_callback  # render_callback(held: bool)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._render)
+        self.held = False  # 本轮请求中是否有长按产生的请求
+        self.requested = 0  # 请求次数
+        self.rendered = 0  # 实际渲染次数
+        self.skipped = 0  # 被后续请求合并而跳过的渲染次数
+
+    def request(self, delay: int, held: bool = False):  # 重新计时，未执行的上一个请求被合并
+        self.requested += 1
+        if self.timer.isActive():
+            self.skipped += 1
+        self.held = self.held or held
+        self.timer.start(delay)
+
+    def flush(self):  # 立即执行等待中的渲染
+        if self.timer.isActive():
+            self.timer.stop()
+            self._render()
+
+    def cancel(self):
+        self.timer.stop()
+        self.held = False
+
+    def _render(self):
+        held, self.held = self.held, False
+        self.rendered += 1
+        self.render_callback(held)
 
 
 class PDFMultiPageWriter:
-    def __init__(self, input_file=None):
+    def __init__(self, input_file=None, doc=None):
         """
         初始化PDF写入器
 
         参数:
         input_file - 可选，要修改的现有PDF文件路径
+        doc - 可选，直接在已打开的文档上写入（与调用方共用同一个句柄）
         """
-        if input_file:
+        if doc is not None:
+            self.doc = doc
+        elif input_file:
             self.doc = fitz.open(input_file)
         else:
             self.doc = fitz.open()
@@ -91,6 +1058,8 @@ class PDFMultiPageWriter:
             'line_width': 0.5,  # 分隔线宽度
             'line_dashes': None  # 分隔线样式（None为实线）
         }
+        self.fonts = {}  # 字体名 -> fitz.Font
+        self.text_widths = {}  # (文本, 字体名, 字号) -> 宽度
 
     def add_content(self, contents, title=None, style=None):
         """
@@ -163,10 +1132,27 @@ class PDFMultiPageWriter:
             color=style['header_color']
         )
 
-    @staticmethod
-    def _add_page_content(page, contents, page_num, lines_per_page, style):
-        """在页面上添加内容项"""
+    def _font(self, fontname):
+        """按字体名缓存 fitz.Font"""
+        font = self.fonts.get(fontname)
+        if font is None:
+            font = self.fonts[fontname] = fitz.Font(fontname)
+        return font
+
+    def _text_length(self, text, fontname, fontsize):
+        """按 (文本, 字体, 字号) 缓存文本宽度，目录中大量重复的页码只测量一次"""
+        key = (text, fontname, fontsize)
+        width = self.text_widths.get(key)
+        if width is None:
+            width = self.text_widths[key] = self._font(fontname).text_length(text, fontsize=fontsize)
+        return width
+
+    def _add_page_content(self, page, contents, page_num, lines_per_page, style):
+        """在页面上添加内容项：整页文字先排进一个 TextWriter，分隔线画进一个 Shape，每页各提交一次"""
         page_width = page.rect.width
+        font = self._font(style['fontname'])
+        writer = fitz.TextWriter(page.rect)
+        shape = page.new_shape()
 
         # 添加内容行
         for i, content in enumerate(contents):
@@ -179,51 +1165,35 @@ class PDFMultiPageWriter:
 
             # 添加行号（可选）
             line_num = line_idx + 1
-            page.insert_text(
-                (style['margin_left'], y_pos),
-                f"{line_num}.",
-                fontname=style['fontname'],
-                fontsize=style['fontsize'] * 0.8,
-                color=style['text_color']
-            )
+            writer.append((style['margin_left'], y_pos), f"{line_num}.", font=font, fontsize=style['fontsize'] * 0.8)
 
             # 左对齐文本
             left_text = str(content[0])
             left_x = style['margin_left'] + 30  # 留出编号空间
-            page.insert_text(
-                (left_x, y_pos),
-                left_text,
-                fontname=style['fontname'],
-                fontsize=style['fontsize'],
-                color=style['text_color']
-            )
+            writer.append((left_x, y_pos), left_text, font=font, fontsize=style['fontsize'])
 
             # 右对齐文本
             right_text = str(content[1])
-            text_width = fitz.get_text_length(right_text, style['fontname'], style['fontsize'])
+            text_width = self._text_length(right_text, style['fontname'], style['fontsize'])
             right_x = page_width - style['margin_right'] - text_width
-
-            page.insert_text(
-                (right_x, y_pos),
-                right_text,
-                fontname=style['fontname'],
-                fontsize=style['fontsize'],
-                color=style['text_color']
-            )
+            writer.append((right_x, y_pos), right_text, font=font, fontsize=style['fontsize'])
 
             # 添加分隔线
             if i < len(contents) - 1:  # 最后一行不添加
                 line_y = y_pos + style['line_spacing'] * 0.8
-                page.draw_line(
-                    (left_x, line_y),
-                    (page_width - style['margin_right'], line_y),
-                    color=style['line_color'],
-                    width=style['line_width'],
-                    dashes=style['line_dashes']
-                )
+                shape.draw_line((left_x, line_y), (page_width - style['margin_right'], line_y))
+
+        # 每页只写入一次文字和一次线条
+        writer.write_text(page, color=style['text_color'])
+        shape.finish(color=style['line_color'], width=style['line_width'], dashes=style['line_dashes'])
+        shape.commit()
 
     def save(self, output_path):
         """保存文档"""
         self.doc.save(output_path)
         self.doc.close()
         # print(f"PDF已保存至: {output_path}")
+
+    def save_incremental(self):
+        """以增量更新的方式把新增页面追加到原文件末尾：不重写已有内容，也不关闭文档"""
+        self.doc.save(self.doc.name, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
@@ -0,0 +1,66 @@
+"""
+这个文件是多进程渲染引擎的工作进程入口，本身只依赖 fitz 和标准库；但进程池用 spawn 启动，
+子进程会先重新导入主模块 glitch_reader（连同 PyQt5），所以每个工作进程的启动成本包括一次 Qt 导入，
+进程池在会话中只建立一次，换文件时由工作进程自己重新打开文件
+"""
+
+from collections import OrderedDict, deque
+import os
+from multiprocessing import resource_tracker, shared_memory
+
+import fitz
+
+MAX_DISPLAY_LISTS = 16  # 每个进程最多缓存的显示列表数
+MAX_OPEN_BLOCKS = 16  # 每个进程保持打开的共享内存块数（Windows 下最后一个句柄关闭时块即被销毁）
+
+_doc = None  # 本进程持有的文件句柄
+_doc_path = ''  # 句柄对应的文件路径
+_display_lists = OrderedDict()  # 页码下标 -> DisplayList
+_blocks = deque()  # 最近创建的共享内存块
+
+
+def _open(file_path: str):
+    """打开要渲染的文件，与已打开的文件不同时先关闭旧文件并清空显示列表"""
+
+    global _doc, _doc_path
+    if file_path == _doc_path:
+        return
+    if _doc is not None:
+        _doc.close()
+    _display_lists.clear()
+    _doc = fitz.open(file_path)
+    _doc_path = file_path
+
+
+def render_to_shared_memory(file_path: str, page_index: int, scale_factor: float, clip=None):
+    """渲染页面（或 clip 区域）并写入新建的共享内存块，返回 (块名, 宽, 高, 行跨度)"""
+
+    _open(file_path)
+    mat = fitz.Matrix(scale_factor, scale_factor)
+    clip = fitz.Rect(clip) if clip is not None else None
+    pix = _display_list(page_index).get_pixmap(matrix=mat, clip=clip, alpha=False)
+    nbytes = pix.stride * pix.height
+
+    block = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+    block.buf[:nbytes] = pix.samples_mv
+    if os.name == 'posix':  # 块交给界面进程：由它登记、接收后删除，本进程不再登记，退出时也不会误报泄漏
+        resource_tracker.unregister(block._name, 'shared_memory')
+    _blocks.append(block)
+    while len(_blocks) > MAX_OPEN_BLOCKS:  # 界面进程接收后会自行删除，这里只关闭本进程的句柄
+        _blocks.popleft().close()
+
+    return block.name, pix.width, pix.height, pix.stride
+
+
+def _display_list(page_index: int):
+    """取页面的显示列表，未缓存时解析内容流"""
+
+    display_list = _display_lists.get(page_index)
+    if display_list is None:
+        display_list = _doc.load_page(page_index).get_displaylist()
+        _display_lists[page_index] = display_list
+        while len(_display_lists) > MAX_DISPLAY_LISTS:
+            _display_lists.popitem(last=False)
+    else:
+        _display_lists.move_to_end(page_index)
+    return display_list
@@ -0,0 +1,56 @@
+"""
+这个文件是启动性能分析：--profile-startup 模式下记录各顶层导入的耗时和启动过程中的关键时刻，
+首屏可阅读后输出报告；只依赖标准库，在其余导入之前安装
+"""
+
+import builtins
+import sys
+import time
+
+import_times = []  # [(模块名, 耗时秒)]，只记录顶层导入，嵌套导入计入外层
+marks = []  # [(事件名, 距启动的秒数)]
+_start = 0.0
+_depth = 0
+_original_import = builtins.__import__
+
+
+def _timed_import(name, *args, **kwargs):
+    global _depth
+    if _depth:
+        return _original_import(name, *args, **kwargs)
+    _depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_import(name, *args, **kwargs)
+    finally:
+        _depth -= 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= 0.001:  # 已导入模块的重复导入不计
+            import_times.append((name, elapsed))
+
+
+def install(start: float):
+    """开始记录导入耗时，start 为启动计时起点"""
+
+    global _start
+    _start = start
+    builtins.__import__ = _timed_import
+
+
+def mark(name: str):
+    """记录一个启动事件"""
+
+    marks.append((name, time.perf_counter() - _start))
+
+
+def report():
+    """停止记录并把报告写到标准错误，返回报告文本"""
+
+    builtins.__import__ = _original_import
+    lines = ['startup profile (ms):']
+    lines += [f'  import {name:<24} {elapsed * 1000:8.1f}'
+              for name, elapsed in sorted(import_times, key=lambda item: -item[1])]
+    lines += [f'  {name:<31} {elapsed * 1000:8.1f}' for name, elapsed in marks]
+    text = '\n'.join(lines)
+    print(text, file=sys.stderr)
+    return text
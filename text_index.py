@@ -0,0 +1,218 @@
+"""
+这个文件是全文倒排索引：后台提取各页单词建立 词项 -> (页码, 单词矩形) 倒排表并写入磁盘，
+之后通过 mmap 按需读取，只依赖 fitz 和标准库，可以在子进程中直接导入；
+另有不建索引的逐页正则扫描 scan_pages，供一次性阅读的文件使用
+
+文件格式（小端）：
+    头部      magic, 版本, 页数, 词项数, 词项表偏移, 字符串区偏移
+    倒排区    每条记录 (页码下标, x0, y0, x1, y1)，同一词项的记录连续存放
+    词项表    每项 (字符串偏移, 字符串长度, 首条记录序号, 记录条数)，按词项 UTF-8 字节序排列
+    字符串区  所有词项的 UTF-8 编码
+"""
+
+import math
+import mmap
+import os
+import re
+import struct
+from contextlib import nullcontext
+
+import fitz
+
+MAGIC = b'GRTI'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIQQ')
+POSTING = struct.Struct('<Iffff')
+TERM = struct.Struct('<IIII')
+TOKEN_SPLIT = re.compile(r'[\W_]+')  # 与 build_search_regex 相同的分词方式
+
+
+def tokenize(text: str):
+    """把文本切分为小写词项"""
+
+    return [token for token in TOKEN_SPLIT.split(text.lower()) if token]
+
+
+def build_index(file_path: str, index_path: str, lock=None):
+    """提取全部页面的单词并写出索引文件，先写临时文件再原子替换，返回索引路径
+
+    在线程中调用时传入 fitz_lock，每页持锁一次；在子进程中调用时无需加锁。
+    """
+
+    lock = lock if lock is not None else nullcontext()
+    postings = {}  # 词项 -> [(页码下标, x0, y0, x1, y1)]
+    with lock:
+        doc = fitz.open(file_path)
+        page_count = doc.page_count
+    try:
+        for page_index in range(page_count):
+            with lock:
+                words = doc[page_index].get_text("words")
+            for word in words:
+                for token in tokenize(word[4]):
+                    postings.setdefault(token, []).append((page_index, word[0], word[1], word[2], word[3]))
+    finally:
+        with lock:
+            doc.close()
+
+    terms = sorted((term.encode('utf-8'), items) for term, items in postings.items())
+    postings_size = sum(len(items) for _, items in terms) * POSTING.size
+    terms_offset = HEADER.size + postings_size
+    strings_offset = terms_offset + len(terms) * TERM.size
+
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, page_count, len(terms), terms_offset, strings_offset))
+        for _, items in terms:
+            for item in items:
+                file.write(POSTING.pack(*item))
+        string_pos = record = 0
+        for term, items in terms:
+            file.write(TERM.pack(string_pos, len(term), record, len(items)))
+            string_pos += len(term)
+            record += len(items)
+        for term, _ in terms:
+            file.write(term)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, index_path)
+    return index_path
+
+
+class TextIndex:
+    """只读的全文索引，通过 mmap 访问，打开时不把倒排表读入内存"""
+
+    def __init__(self, index_path: str):
+        self.file = open(index_path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.page_count, self.term_count, self.terms_offset, self.strings_offset \
+            = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"unsupported index file: {index_path}")
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.file.close()
+        self.data = None
+
+    def _term(self, i: int):
+        string_pos, length, record, count = TERM.unpack_from(self.data, self.terms_offset + i * TERM.size)
+        start = self.strings_offset + string_pos
+        return self.data[start:start + length], record, count
+
+    def _lower_bound(self, key: bytes):
+        low, high = 0, self.term_count
+        while low < high:
+            mid = (low + high) // 2
+            if self._term(mid)[0] < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def _records(self, record: int, count: int):
+        start = HEADER.size + record * POSTING.size
+        return list(POSTING.iter_unpack(self.data[start:start + count * POSTING.size]))
+
+    def postings(self, token: str, prefix: bool = False):
+        """返回词项（prefix 为 True 时为所有以 token 开头的词项）的全部倒排记录"""
+
+        key = token.encode('utf-8')
+        i = self._lower_bound(key)
+        records = []
+        while i < self.term_count:
+            term, record, count = self._term(i)
+            if term != key and not (prefix and term.startswith(key)):
+                break
+            records.extend(self._records(record, count))
+            i += 1
+        return records
+
+    def search(self, query: str, limit: int = 200):
+        """多词查询，最后一个词按前缀匹配；返回按相关度排序的 [(页码下标, [矩形元组], 得分)]"""
+
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        pages = None
+        per_token = []
+        for n, token in enumerate(tokens):
+            by_page = {}
+            for page_index, x0, y0, x1, y1 in self.postings(token, prefix=n == len(tokens) - 1):
+                by_page.setdefault(page_index, []).append((x0, y0, x1, y1))
+            per_token.append(by_page)
+            pages = set(by_page) if pages is None else pages & set(by_page)  # 只保留包含全部词项的页面
+            if not pages:
+                return []
+
+        hits = []
+        for page_index in pages:
+            score = 0.0
+            rects = []
+            for by_page in per_token:
+                idf = math.log(1 + self.page_count / len(by_page))
+                score += (1 + math.log(len(by_page[page_index]))) * idf
+                rects.extend(by_page[page_index])
+            hits.append((page_index, rects, score))
+        hits.sort(key=lambda hit: (-hit[2], hit[0]))
+        return hits[:limit]
+
+
+def outward_order(current_page_index: int, total_page: int):
+    """从当前页开始向两侧交替展开的页码下标：当前页、后一页、前一页、后两页……"""
+
+    yield current_page_index
+    for step in range(1, total_page):
+        if current_page_index + step < total_page:
+            yield current_page_index + step
+        if current_page_index - step >= 0:
+            yield current_page_index - step
+        if current_page_index + step >= total_page and current_page_index - step < 0:
+            return
+
+
+def match_line_rects(words, pattern):
+    """按行拼接单词后做正则匹配，返回每处匹配覆盖的单词矩形"""
+
+    lines = {}
+    for word in words:
+        lines.setdefault((word[5], word[6]), []).append(word)
+    rects = []
+    for line in lines.values():
+        starts = []
+        text = ''
+        for word in line:
+            starts.append(len(text))
+            text += word[4] + ' '
+        for match in pattern.finditer(text):
+            if match.end() == match.start():  # 空查询的 .* 会产生空匹配
+                continue
+            rects.extend(tuple(word[:4]) for word, start in zip(line, starts)
+                         if start < match.end() and start + len(word[4]) > match.start())
+    return rects
+
+
+def scan_pages(file_path: str, pattern, current_page_index: int, cancel, lock=None):
+    """逐页扫描文本，从当前页向两侧展开，每找到一页命中就产出 (页码下标, [矩形元组])
+
+    一次只持有一页的单词，内存占用与文档大小无关；cancel 是 threading.Event，置位后在下一页前停止。
+    """
+
+    lock = lock if lock is not None else nullcontext()
+    with lock:
+        doc = fitz.open(file_path)
+        page_count = doc.page_count
+    try:
+        for page_index in outward_order(min(current_page_index, page_count - 1), page_count):
+            if cancel.is_set():
+                return
+            with lock:
+                words = doc[page_index].get_text("words")
+            rects = match_line_rects(words, pattern)
+            if rects:
+                yield page_index, rects
+    finally:
+        with lock:
+            doc.close()